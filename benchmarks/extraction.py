@@ -0,0 +1,111 @@
+import argparse
+import os
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+from extractor import DescriptionExtractor
+
+# Compares the incremental lxml description extractor with the
+# BeautifulSoup path it replaced, on saved wiki pages: either a directory
+# of .html files or the /Software pages held in the response cache.
+
+
+def legacyDescription(wikiSource):
+    description = ""
+    wikiWithContentSoup = BeautifulSoup(wikiSource, 'lxml')
+    wikiWithContentContent = wikiWithContentSoup.find(
+        'div', id='bodyContent')
+    if wikiWithContentContent is None:
+        return "..."
+    paragraphs = []
+    for paragraph in wikiWithContentContent.findAll('p'):
+        temp = "".join(line.strip()
+                       for line in paragraph.text.split("\n"))
+        if "<style" in str(paragraph) or "</style>" in str(paragraph) or "<script" in str(paragraph) or \
+                "</script>" in str(paragraph) or len(temp) == 0:
+            pass
+        else:
+            paragraphs.append("".join(line.strip()
+                                      for line in paragraph.text.split("\n")))
+    j = 0
+    while len(description) < 500 and j < len(paragraphs):
+        k = 0
+        while len(description) < 500 and k < len(paragraphs[j]):
+            description += paragraphs[j][k]
+            k += 1
+        j += 1
+        description += " "
+    description += "..."
+    return description
+
+
+def extractedDescription(wikiSource):
+    return DescriptionExtractor().feedAll(wikiSource)
+
+
+def loadPages(source):
+    pages = []
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if name.endswith('.html') or name.endswith('.htm'):
+                with open(os.path.join(source, name), encoding='utf-8', errors='replace') as page:
+                    pages.append((name, page.read()))
+    else:
+        import sqlite3
+        connection = sqlite3.connect(source)
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT url, encoding, body FROM http_cache WHERE url LIKE '%/Software'")
+        for url, encoding, body in cursor.fetchall():
+            pages.append((url, zlib.decompress(body).decode(
+                encoding or 'utf-8', errors='replace')))
+    return pages
+
+
+def measure(function, pages, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        outputs = [function(page) for name, page in pages]
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, outputs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark description extraction on saved wiki pages")
+    parser.add_argument("source", nargs="?", default="software.db",
+                        help="directory of .html pages or a database with a response cache (default: software.db)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    pages = loadPages(args.source)
+    if len(pages) == 0:
+        print("No saved pages found in " + args.source, file=sys.stderr)
+        return 1
+    size = sum(len(page) for name, page in pages)
+
+    legacyTime, legacyOutputs = measure(legacyDescription, pages, args.repeat)
+    extractedTime, extractedOutputs = measure(
+        extractedDescription, pages, args.repeat)
+
+    print("{} pages, {:.1f} MB".format(len(pages), size / 1e6))
+    print("beautifulsoup  {:8.1f} ms  {:7.1f} pages/s".format(legacyTime * 1000, len(pages) / legacyTime))
+    print("extractor      {:8.1f} ms  {:7.1f} pages/s".format(extractedTime * 1000, len(pages) / extractedTime))
+    print("speedup        {:8.1f}x".format(legacyTime / extractedTime))
+    different = [name for (name, page), legacy, extracted in zip(pages, legacyOutputs, extractedOutputs)
+                 if legacy != extracted]
+    print("{} of {} descriptions differ".format(len(different), len(pages)))
+    for name in different:
+        print("  " + name)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model import Model
+from software import Software
+
+# Times the Model on synthetic libraries of a given size: ingest, listing,
+# per-year lookups, search and the size of the database file. Results can
+# be written as JSON and compared with an earlier run.
+
+words = ("gene circuit protein design sequence model simulation plasmid promoter biobrick "
+         "assembly toolkit database web interface python modelling expression kinetics "
+         "codon optimisation primer crispr guide library registry parts visualisation "
+         "network analysis pipeline machine learning growth fluorescence reporter enzyme "
+         "pathway metabolic flux stochastic deterministic parameter fitting open source "
+         "software tool wiki team project data structure alignment blast search").split()
+years = list(range(2008, 2025))
+
+
+def makeLibrary(rows, seed):
+    generator = random.Random(seed)
+    library = []
+    for i in range(rows):
+        team = "Team{:06d}".format(i)
+        description = ""
+        while len(description) < 500:
+            description += generator.choice(words).capitalize() + " " + \
+                " ".join(generator.choice(words) for j in range(generator.randint(6, 14))) + ". "
+        library.append(Software(team, description[:500] + "...", years[i % len(years)],
+                                "{:040x}".format(generator.getrandbits(160)), time.time()))
+    return library
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def summary(seconds):
+    return {'medianMs': percentile(seconds, 0.5) * 1000, 'p95Ms': percentile(seconds, 0.95) * 1000}
+
+
+def measure(rows, args):
+    library = makeLibrary(rows, args.seed)
+    generator = random.Random(args.seed + 1)
+    result = {'rows': rows}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'software.db')
+        model = Model(path)
+
+        # Ingest the way a scrape does, in BufferedWriter sized batches.
+        start = time.perf_counter()
+        for first in range(0, rows, args.batch):
+            model.writeBatch(library[first:first + args.batch], [])
+        elapsed = time.perf_counter() - start
+        result['ingestRowsPerSecond'] = rows / elapsed
+
+        # Then edits, one replace per row.
+        sample = [generator.choice(library) for i in range(args.samples)]
+        seconds = [timed(model.replace, Software(software.team, software.description, software.year))[0]
+                   for software in sample]
+        result['replace'] = summary(seconds)
+
+        result['getAllMs'] = min(timed(model.getAll)[0] for i in range(args.repeat)) * 1000
+
+        seconds = []
+        after = None
+        while True:
+            elapsed, page = timed(model.getPage, None, after, 100)
+            seconds.append(elapsed)
+            if len(page) < 100:
+                break
+            after = (page[-1][2], page[-1][0])
+        result['getPage'] = summary(seconds)
+
+        result['getAllFromYear'] = summary(
+            [timed(model.getAllFromYear, generator.choice(years))[0] for i in range(args.samples)])
+        result['checkYear'] = summary(
+            [timed(model.checkYear, generator.choice(years + [1999]))[0] for i in range(args.samples)])
+
+        queries = [" ".join(generator.choice(words) for j in range(generator.randint(1, 3)))
+                   for i in range(args.samples)]
+        queries += [generator.choice(words)[:3] for i in range(args.samples // 4)]
+        result['search'] = summary([timed(model.search, query)[0] for query in queries])
+
+        model.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        model.connection.close()
+        result['fileBytes'] = sum(os.path.getsize(os.path.join(directory, name))
+                                  for name in os.listdir(directory))
+    return result
+
+
+def revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def show(results, baseline):
+    earlier = {}
+    if baseline is not None:
+        earlier = {result['rows']: result for result in baseline['results']}
+    columns = [("ingest rows/s", lambda r: r['ingestRowsPerSecond']),
+               ("replace ms", lambda r: r['replace']['medianMs']),
+               ("getAll ms", lambda r: r['getAllMs']),
+               ("getPage ms", lambda r: r['getPage']['medianMs']),
+               ("year ms", lambda r: r['getAllFromYear']['medianMs']),
+               ("checkYear ms", lambda r: r['checkYear']['medianMs']),
+               ("search ms", lambda r: r['search']['medianMs']),
+               ("search p95 ms", lambda r: r['search']['p95Ms']),
+               ("file MB", lambda r: r['fileBytes'] / 1e6)]
+    for result in results:
+        print("{} rows".format(result['rows']))
+        for name, value in columns:
+            line = "  {:<14} {:12.2f}".format(name, value(result))
+            if result['rows'] in earlier:
+                before = value(earlier[result['rows']])
+                if before > 0:
+                    line += "  {:+7.1f}%".format((value(result) - before) / before * 100)
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark Model queries and ingest on synthetic libraries")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--batch", type=int, default=50,
+                        help="rows per write during ingest (default: 50, as BufferedWriter)")
+    parser.add_argument("--samples", type=int, default=200,
+                        help="lookups, searches and edits timed per size (default: 200)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", "-o", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file from an earlier run to compare with")
+    args = parser.parse_args(argv)
+
+    results = [measure(rows, args) for rows in args.rows]
+    report = {'revision': revision(), 'time': time.time(), 'python': platform.python_version(),
+              'sqlite': sqlite3.sqlite_version, 'batch': args.batch, 'samples': args.samples,
+              'seed': args.seed, 'results': results}
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+    show(results, baseline)
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
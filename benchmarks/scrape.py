@@ -0,0 +1,120 @@
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model import Model
+from replay import Archive, ReplayAdapter
+from scheduler import Scheduler
+from transport import AdaptiveLimit, Transport
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Replays a scrape recorded with `sara.py scrape --record` and reports
+# throughput, wall time and peak memory for each combination of settings.
+# Every combination runs in a fresh process so peak RSS is its own.
+
+
+def recordedYears(archive):
+    return sorted(int(url.split('year=')[1]) for url in archive.index if 'Team_Wikis?year=' in url)
+
+
+def peakRss(who):
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak / 1024 if sys.platform != 'darwin' else peak / 1024 / 1024
+
+
+def runOnce(args, workers, parseWorkers):
+    archive = Archive(args.archive)
+    years = args.years or recordedYears(archive)
+    adapter = ReplayAdapter(archive, args.latency / 1000, args.jitter / 1000)
+    limit = None if args.fixed else AdaptiveLimit(workers)
+    transport = Transport(poolSize=workers, rate=args.rate, burst=args.rate, adapter=adapter, limit=limit)
+    with tempfile.TemporaryDirectory() as directory:
+        model = Model(os.path.join(directory, 'software.db'))
+        scheduler = Scheduler(model, lambda value: None, lambda software: None, workers,
+                              transport, parseWorkers, args.queue_size)
+        start = time.perf_counter()
+        scheduler.run(years)
+        elapsed = time.perf_counter() - start
+        pages = scheduler.metrics.snapshot()['pages']
+        model.connection.close()
+    archive.close()
+    return {'workers': workers, 'parseWorkers': parseWorkers, 'years': years, 'pages': pages,
+            'seconds': elapsed, 'pagesPerSecond': pages / elapsed if elapsed > 0 else 0,
+            'peakRssMb': peakRss(resource.RUSAGE_SELF) if resource is not None else None,
+            'peakChildRssMb': peakRss(resource.RUSAGE_CHILDREN) if resource is not None else None,
+            'missing': adapter.stats['missing'], 'finalLimit': limit.getStats()['limit'] if limit else workers}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark scraping against a recorded archive")
+    parser.add_argument("archive", help="zip file written by sara.py scrape --record")
+    parser.add_argument("--years", type=int, nargs="*",
+                        help="years to scrape (default: every recorded year)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[8])
+    parser.add_argument("--parse-workers", type=int, nargs="+", default=[0])
+    parser.add_argument("--queue-size", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="milliseconds added to every response (default: 0)")
+    parser.add_argument("--jitter", type=float, default=0,
+                        help="milliseconds by which the latency varies either way (default: 0)")
+    parser.add_argument("--rate", type=float, default=1000,
+                        help="requests per second allowed per host (default: 1000)")
+    parser.add_argument("--fixed", action="store_true",
+                        help="fetch --workers pages at a time instead of adapting the limit")
+    parser.add_argument("--json", action="store_true",
+                        help="print results as JSON lines")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.single:
+        print(json.dumps(runOnce(args, args.workers[0], args.parse_workers[0])))
+        return 0
+
+    results = []
+    for workers, parseWorkers in itertools.product(args.workers, args.parse_workers):
+        command = [sys.executable, os.path.abspath(__file__), args.archive, "--single",
+                   "--workers", str(workers), "--queue-size", str(args.queue_size),
+                   "--latency", str(args.latency), "--jitter", str(args.jitter), "--rate", str(args.rate)]
+        if args.fixed:
+            command.append("--fixed")
+        if parseWorkers is not None:
+            command += ["--parse-workers", str(parseWorkers)]
+        if args.years:
+            command += ["--years"] + [str(year) for year in args.years]
+        output = subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout
+        results.append(json.loads(output.decode('utf-8').strip().splitlines()[-1]))
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        return 0
+    print("workers  limit  parse  pages  seconds  pages/s  peak MB  children MB")
+    for result in results:
+        print("{:7d}  {:5d}  {:>5}  {:5d}  {:7.2f}  {:7.1f}  {:>7}  {:>11}".format(
+            result['workers'], result['finalLimit'],
+            "auto" if result['parseWorkers'] is None else result['parseWorkers'],
+            result['pages'], result['seconds'], result['pagesPerSecond'],
+            "-" if result['peakRssMb'] is None else "{:.1f}".format(result['peakRssMb']),
+            "-" if result['peakChildRssMb'] is None else "{:.1f}".format(result['peakChildRssMb'])))
+        if result['missing'] > 0:
+            print("         {} requests were not in the archive".format(result['missing']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
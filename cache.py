@@ -0,0 +1,76 @@
+import sqlite3
+import threading
+import time
+import zlib
+import requests
+from model import Model
+
+
+class CacheMiss(requests.RequestException):
+    pass
+
+
+class ResponseCache():
+    def __init__(self, path='software.db', maxSize=64 * 1024 * 1024):
+        # http_cache is part of the database's schema, which Model keeps
+        # up to date.
+        Model(path).connection.close()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.maxSize = maxSize
+
+    def get(self, url):
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("SELECT etag, modified, encoding, body, stored, complete FROM http_cache WHERE url = :url",
+                           {'url': url})
+            entry = cursor.fetchone()
+            if entry is None:
+                return None
+            cursor.execute("UPDATE http_cache SET accessed = :accessed WHERE url = :url",
+                           {'accessed': time.time(), 'url': url})
+            self.connection.commit()
+        return {'etag': entry[0], 'modified': entry[1], 'encoding': entry[2],
+                'body': zlib.decompress(entry[3]), 'stored': entry[4], 'complete': entry[5] != 0}
+
+    def put(self, url, etag, modified, encoding, body, complete=True):
+        # A body cut short by a streaming reader is stored as incomplete:
+        # it is only served to readers that stop within it again.
+        compressed = zlib.compress(body)
+        now = time.time()
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("""REPLACE INTO http_cache (url, etag, modified, encoding, body, size, stored, accessed, complete)
+                VALUES (:url, :etag, :modified, :encoding, :body, :size, :stored, :accessed, :complete)""",
+                           {'url': url, 'etag': etag, 'modified': modified, 'encoding': encoding,
+                            'body': compressed, 'size': len(compressed), 'stored': now, 'accessed': now,
+                            'complete': 1 if complete else 0})
+            self.evict(cursor)
+            self.connection.commit()
+
+    def touch(self, url):
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("UPDATE http_cache SET stored = :stored WHERE url = :url",
+                           {'stored': time.time(), 'url': url})
+            self.connection.commit()
+
+    def evict(self, cursor):
+        cursor.execute("SELECT COALESCE(SUM(size), 0) FROM http_cache")
+        total = cursor.fetchone()[0]
+        if total <= self.maxSize:
+            return
+        cursor.execute("SELECT url, size FROM http_cache ORDER BY accessed")
+        victims = []
+        for url, size in cursor.fetchall():
+            if total <= self.maxSize:
+                break
+            victims.append((url,))
+            total -= size
+        cursor.executemany("DELETE FROM http_cache WHERE url = ?", victims)
+
+    def clear(self):
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("DELETE FROM http_cache")
+            self.connection.commit()
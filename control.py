@@ -0,0 +1,99 @@
+import socket
+import threading
+
+
+class Cancelled(Exception):
+    pass
+
+
+class ScrapeControl():
+    # Shared by everything taking part in one scrape. Pausing holds back
+    # new requests; cancelling wakes everything that waits and cuts off
+    # requests still waiting for their headers and responses that are
+    # still being read.
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self.running = threading.Event()
+        self.running.set()
+        self.lock = threading.Lock()
+        self.responses = set()
+        # The connection each thread's request holds until its headers
+        # arrive.
+        self.connections = {}
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def isPaused(self):
+        return not self.running.is_set()
+
+    def cancel(self):
+        self.cancelled.set()
+        self.running.set()
+        with self.lock:
+            responses = list(self.responses)
+            connections = list(self.connections.values())
+        for response in responses:
+            abort(response)
+        for connection in connections:
+            shutdown(connection.sock)
+
+    def isCancelled(self):
+        return self.cancelled.is_set()
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise Cancelled('Scrape cancelled')
+
+    def waitIfPaused(self):
+        self.running.wait()
+        self.check()
+
+    def sleep(self, seconds):
+        if self.cancelled.wait(seconds):
+            raise Cancelled('Scrape cancelled')
+
+    def track(self, response):
+        with self.lock:
+            self.responses.add(response)
+        if self.cancelled.is_set():
+            abort(response)
+
+    def untrack(self, response):
+        with self.lock:
+            self.responses.discard(response)
+
+    def hold(self, connection):
+        # Called when a request takes a connection from its pool and again
+        # once it is connected, since a new one has no socket before.
+        with self.lock:
+            self.connections[threading.get_ident()] = connection
+        if self.cancelled.is_set():
+            shutdown(connection.sock)
+
+    def release(self):
+        with self.lock:
+            self.connections.pop(threading.get_ident(), None)
+
+
+def abort(response):
+    # Shutting the socket down wakes a thread blocked reading from it,
+    # which closing the response from another thread does not.
+    sock = getattr(getattr(response.raw, 'connection', None), 'sock', None)
+    if sock is None:
+        # Once the headers are read, http.client keeps the socket only
+        # inside the response's file object.
+        file = getattr(getattr(response.raw, '_fp', None), 'fp', None)
+        sock = getattr(getattr(file, 'raw', None), '_sock', None)
+    shutdown(sock)
+
+
+def shutdown(sock):
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
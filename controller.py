@@ -1,147 +1,421 @@
-from model import Model
-from view import View
+import os
+import sqlite3
+import threading
+from control import Cancelled, ScrapeControl
+from metrics import Metrics
+from model import Model, QueryCache
+from view import View, SoftwareListModel
 from software import Software
-from scraper import Scraper
 from PyQt5 import QtCore, QtGui, QtWidgets
 
 
 class ScrapeThread(QtCore.QThread):
-    progress = QtCore.pyqtSignal(int)
+    progress = QtCore.pyqtSignal(object)
     finished = QtCore.pyqtSignal()
-    result = QtCore.pyqtSignal(Software)
+    resultsReady = QtCore.pyqtSignal()
 
-    def __init__(self, year):
+    def __init__(self, years, path='software.db', workers=8, listener=None):
         QtCore.QThread.__init__(self)
-        self.year = year
-        self.scraper = Scraper(self.progress, self.result)
-
-    def __del__(self):
-        self.wait()
+        self.years = years
+        self.path = path
+        self.workers = workers
+        self.listener = listener
+        self.reports = {}
+        self.metrics = Metrics()
+        self.control = ScrapeControl()
+        self.cancelled = False
+        self.error = None
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def stop(self, timeout=10000):
+        # Cancels the scrape and waits at most timeout milliseconds for the
+        # thread to save its results. Cancelling cuts off every request and
+        # wait, so only a connection still being opened can hold it up. It
+        # is never terminated, which could leave software.db mid-write.
+        self.control.cancel()
+        return self.wait(timeout)
 
     def getData(self):
-        self.scraper.scrape(self.year)
+        # Imported here so that requests, bs4 and lxml are only loaded once
+        # a scrape starts.
+        from scheduler import Scheduler
+        model = Model(self.path)
+        if self.listener is not None:
+            model.listeners.append(self.listener)
+        scheduler = Scheduler(model, self.progress.emit,
+                              self.addResult, self.workers, metrics=self.metrics, control=self.control)
+        self.reports = scheduler.reports
+        scheduler.run(self.years)
+
+    def addResult(self, software):
+        # Results are collected here and taken in batches by the GUI thread.
+        # Only the first result of a batch emits resultsReady, so there is
+        # never more than one of them waiting in the event loop.
+        with self.lock:
+            self.pending.append(software)
+            first = len(self.pending) == 1
+        if first:
+            self.resultsReady.emit()
+
+    def takeResults(self):
+        with self.lock:
+            results = self.pending
+            self.pending = []
+        return results
 
     def run(self):
-        self.getData()
-        self.finished.emit()
+        try:
+            self.getData()
+        except Cancelled:
+            self.cancelled = True
+        except Exception as error:
+            # Pages that fail are skipped by the scraper; this is a year
+            # that could not be read at all. It is left to be resumed.
+            self.error = error
+        finally:
+            self.finished.emit()
+
+
+class QueryWorker(QtCore.QObject):
+    requested = QtCore.pyqtSignal(int, str, int, str, object)
+    finished = QtCore.pyqtSignal(int, object)
+
+    def __init__(self, path='software.db', listener=None):
+        QtCore.QObject.__init__(self)
+        self.path = path
+        self.listener = listener
+        self.model = None
+        self.lock = threading.Lock()
+        self.lastId = 0
+        self.generations = {}
+        self.running = None
+        self.requested.connect(self.run)
+
+    def submit(self, channel, method, args, fresh=True):
+        # A fresh request makes everything queued or running on its channel
+        # obsolete; page requests ride along with the current generation.
+        # Writes must never be fresh, or a second edit would drop the first.
+        with self.lock:
+            self.lastId += 1
+            generation = self.generations.get(channel, 0)
+            if fresh:
+                generation += 1
+                self.generations[channel] = generation
+                if self.running == channel:
+                    self.model.connection.interrupt()
+            requestId = self.lastId
+        self.requested.emit(requestId, channel, generation, method, args)
+        return requestId, generation
+
+    def cancel(self, channel):
+        with self.lock:
+            self.generations[channel] = self.generations.get(channel, 0) + 1
+            if self.running == channel:
+                self.model.connection.interrupt()
+
+    def isCurrent(self, channel, generation):
+        with self.lock:
+            return self.generations.get(channel, 0) == generation
+
+    @QtCore.pyqtSlot(int, str, int, str, object)
+    def run(self, requestId, channel, generation, method, args):
+        if self.model is None:
+            self.model = Model(self.path)
+            if self.listener is not None:
+                self.model.listeners.append(self.listener)
+        rows = None
+        for attempt in range(2):
+            with self.lock:
+                if self.generations.get(channel, 0) != generation:
+                    break
+                self.running = channel
+            try:
+                rows = getattr(self.model, method)(*args)
+                break
+            except sqlite3.OperationalError:
+                # Interrupted; retried once if the request is still current.
+                pass
+            finally:
+                with self.lock:
+                    self.running = None
+        self.finished.emit(requestId, rows)
 
 
 class Controller:
     def __init__(self, model, view, parent=None):
         self.model = model
         self.view = view
-
-        for buttons in self.view.menuButtons:
-            buttons[0].clicked.connect(lambda: self.prepareBack())
-            buttons[1].clicked.connect(lambda: self.view.switchTo(0))
-            buttons[2].clicked.connect(lambda: self.openLibrary())
-            buttons[3].clicked.connect(lambda: self.view.switchTo(2))
-            buttons[4].clicked.connect(lambda: self.view.switchTo(3))
-
-        self.view.homeLibraryButton.clicked.connect(lambda: self.openLibrary())
-        self.view.homeSearchButton.clicked.connect(lambda: self.view.switchTo(2))
-        self.view.homeInfoButton.clicked.connect(lambda: self.view.switchTo(3))
-
-        self.view.librarySearchLine.returnPressed.connect(self.startSearching)
-        self.view.scrapeSearchLine.returnPressed.connect(self.prepareScrape)
-
-        self.view.libraryResultsList.currentItemChanged.connect(self.viewSoftware)
-
-        self.view.editButton.clicked.connect(lambda: self.edit())
-        self.view.confirmButton.clicked.connect(lambda: self.confirmEdit())
-        self.view.cancelButton.clicked.connect(lambda: self.cancelEdit())
+        self.pageSize = 100
+
+        self.searchCache = QueryCache()
+        self.model.listeners.append(self.searchCache.clear)
+        self.searchTimer = QtCore.QTimer()
+        self.searchTimer.setSingleShot(True)
+        self.searchTimer.setInterval(250)
+        self.searchTimer.timeout.connect(self.startSearching)
+        self.metricsTimer = QtCore.QTimer()
+        self.metricsTimer.setInterval(500)
+        self.metricsTimer.timeout.connect(self.updateMetrics)
+
+        self.callbacks = {}
+        self.queries = QueryWorker(self.model.path, self.searchCache.clear)
+        self.queryThread = QtCore.QThread()
+        self.queries.moveToThread(self.queryThread)
+        self.queries.finished.connect(self.queryFinished)
+        self.queryThread.start()
+        self.view.app.aboutToQuit.connect(self.stopQueries)
+        self.view.app.aboutToQuit.connect(self.stopScrape)
+        self.scrapeThread = None
+
+        self.view.pageListeners.append(self.connectPage)
+        for index in sorted(self.view.built):
+            self.connectPage(index)
 
         self.view.window.show()
 
+        QtCore.QTimer.singleShot(0, self.resumeScrape)
+
+    def connectPage(self, index):
+        buttons = self.view.menuButtons[index]
+        buttons[0].clicked.connect(lambda: self.prepareBack())
+        buttons[1].clicked.connect(lambda: self.view.switchTo(0))
+        buttons[2].clicked.connect(lambda: self.openLibrary())
+        buttons[3].clicked.connect(lambda: self.view.switchTo(2))
+        buttons[4].clicked.connect(lambda: self.view.switchTo(3))
+
+        if index == 0:
+            self.view.homeLibraryButton.clicked.connect(lambda: self.openLibrary())
+            self.view.homeSearchButton.clicked.connect(lambda: self.view.switchTo(2))
+            self.view.homeInfoButton.clicked.connect(lambda: self.view.switchTo(3))
+        elif index == 1:
+            self.view.librarySearchLine.returnPressed.connect(self.startSearching)
+            self.view.librarySearchLine.textEdited.connect(lambda: self.searchTimer.start())
+            self.view.libraryResultsList.selectionModel().currentChanged.connect(self.viewSoftware)
+        elif index == 2:
+            self.view.scrapeSearchLine.returnPressed.connect(self.prepareScrape)
+            self.view.pauseButton.clicked.connect(lambda: self.togglePause())
+            self.view.stopButton.clicked.connect(lambda: self.cancelScrape())
+        elif index == 4:
+            self.view.editButton.clicked.connect(lambda: self.edit())
+            self.view.confirmButton.clicked.connect(lambda: self.confirmEdit())
+            self.view.cancelButton.clicked.connect(lambda: self.cancelEdit())
+
+    def query(self, channel, method, args, callback=None, fresh=True):
+        requestId, generation = self.queries.submit(channel, method, args, fresh)
+        self.callbacks[requestId] = (channel, generation, callback)
+
+    def queryFinished(self, requestId, rows):
+        channel, generation, callback = self.callbacks.pop(requestId)
+        if rows is not None and callback is not None and self.queries.isCurrent(channel, generation):
+            callback(rows)
+
+    def stopQueries(self):
+        self.queryThread.quit()
+        self.queryThread.wait()
+
     def edit(self):
         self.view.enableAddEdit()
 
     def confirmEdit(self):
         self.view.disableAddEdit()
         software = Software(self.view.addEditTeam.text(), self.view.addEditDescription.toPlainText(), str(self.view.addEditYear.text()))
-        self.model.replace(software)
+        self.query('edit', 'replace', (software,), fresh=False)
     
     def cancelEdit(self):
         self.view.disableAddEdit()
-        self.view.addEditDescription.setText(self.view.libraryResultsList.itemWidget(self.view.libraryResultsList.currentItem()).description.text())
+        software = self.view.libraryResultsList.currentIndex().data(SoftwareListModel.SoftwareRole)
+        self.view.addEditDescription.setText(software.description)
 
     def prepareBack(self):
-        self.startSearching()
+        if 1 in self.view.built:
+            self.startSearching()
         self.view.goBack()
 
-    def viewSoftware(self):
-        selectedWidget = self.view.libraryResultsList.itemWidget(self.view.libraryResultsList.currentItem())
-        if selectedWidget != None:
-            self.view.addEditTeam.setText(selectedWidget.team.text())
-            self.view.addEditDescription.setText(selectedWidget.description.text())
-            self.view.addEditYear.setText(selectedWidget.year.text())
+    def viewSoftware(self, current):
+        if current.isValid():
+            software = current.data(SoftwareListModel.SoftwareRole)
+            self.view.buildPage(4)
+            self.view.addEditTeam.setText(software.team)
+            self.view.addEditDescription.setText(software.description)
+            self.view.addEditYear.setText(software.year)
             self.view.switchTo(4)
 
     def openLibrary(self):
+        self.view.buildPage(1)
         self.listAll()
         self.view.switchTo(1)
 
     def listAll(self):
-        self.view.libraryResultsList.clear()
-        softwareList = self.model.getAll()
-        for i in softwareList:
-            software = Software(i[0], i[1], str(i[2]))
-            self.view.addToList(self.view.libraryResultsList, software)
+        self.view.libraryResults.setSource(
+            lambda last: self.requestPage('library', self.view.libraryResults, None, last), self.pageSize)
+
+    def requestPage(self, channel, results, years, last):
+        after = None if last is None else (int(last.year), last.team)
+        self.query(channel, 'getPage', (None, after, self.pageSize, years),
+                   lambda softwareList: results.addPage(
+                       [(Software(i[0], i[1], str(i[2])), None) for i in softwareList]),
+                   last is None)
 
     def startSearching(self):
-        self.view.libraryResultsList.clear()
-        if len(self.view.librarySearchLine.text()) == 0 or self.view.librarySearchLine.text() == "Enter a year":
+        self.searchTimer.stop()
+        text = self.view.librarySearchLine.text().strip()
+        if len(text) == 0 or text == self.view.librarySearchLine.suggestion:
             self.listAll()
+        elif text.isdigit():
+            year = int(text)
+            self.view.libraryResults.setSource(
+                lambda last: self.requestPage('library', self.view.libraryResults, [year], last), self.pageSize)
         else:
-            year = int(self.view.librarySearchLine.text())
-            softwareList = self.model.getAllFromYear(year)
-            for i in softwareList:
-                software = Software(i[0], i[1], str(i[2]))
-                self.view.addToList(self.view.libraryResultsList, software)
+            softwareList = self.searchCache.get(text)
+            if softwareList is None:
+                version = self.searchCache.version
+                self.query('library', 'search', (text,),
+                           lambda softwareList: self.showSearchResults(text, softwareList, version))
+            else:
+                # Whatever the library is still waiting for would replace
+                # these rows when it arrives.
+                self.queries.cancel('library')
+                self.showSearchResults(text, softwareList, None)
+
+    def showSearchResults(self, text, softwareList, version):
+        if version is not None:
+            self.searchCache.put(text, softwareList, version)
+        self.view.libraryResults.updateSoftware(
+            [(Software(i[1], i[2], str(i[3])), i[4]) for i in softwareList])
+
+    def resumeScrape(self):
+        years = self.model.getUnfinishedYears()
+        if len(years) == 0:
+            return
+        resumeMessage = QtWidgets.QMessageBox()
+        choice = resumeMessage.question(self.view.window, "Sara", "Sara was interrupted while searching the web for software from " + ", ".join(str(year) for year in years) + ". Do you want to continue where it stopped?", resumeMessage.Yes | resumeMessage.No)
+
+        if choice == resumeMessage.Yes:
+            self.view.switchTo(2)
+            self.startScraping([])
+        else:
+            self.model.cancelJobs()
 
-    def prepareScrape(self):
-        year = int(self.view.scrapeSearchLine.text())
+    def isScraping(self):
+        return self.scrapeThread is not None and self.scrapeThread.isRunning()
 
-        if self.model.checkYear(year):
+    def prepareScrape(self):
+        from scheduler import parseYears
+        if self.isScraping():
+            if self.scrapeThread.control.isCancelled():
+                busyMessage = QtWidgets.QMessageBox()
+                busyMessage.question(self.view.window, "Sara", "Sara is still stopping the last search. Try again in a moment.", busyMessage.Ok)
+            return
+        text = self.view.scrapeSearchLine.text()
+        try:
+            years = parseYears(text)
+        except ValueError:
+            errorMessage = QtWidgets.QMessageBox()
+            errorMessage.question(self.view.window, "Sara", "Enter a year, a range of years like 2014-2016, or a list like 2012, 2014.", errorMessage.Ok)
+            return
+
+        if any(self.model.checkYear(year) for year in years):
             overwriteMessage = QtWidgets.QMessageBox()
-            choice = overwriteMessage.question(self.view.window, "Sara", "Software from this year can already be found in the Library. Clicking \"Yes\" will overwrite these.", overwriteMessage.Yes | overwriteMessage.No)
+            choice = overwriteMessage.question(self.view.window, "Sara", "Software from these years can already be found in the Library. Clicking \"Yes\" will update the ones that have changed.", overwriteMessage.Yes | overwriteMessage.No)
 
             if choice == overwriteMessage.Yes:
-                self.startScraping(year)
+                self.startScraping(years)
             else:
-                self.view.scrapeSearchLine.setText(str(year))
+                self.view.scrapeSearchLine.setText(text)
 
         else:
             scrapeMessage = QtWidgets.QMessageBox()
-            choice = scrapeMessage.question(self.view.window, "Sara", "Sara will now search the web for software from this year. Do you want to continue?", scrapeMessage.Yes | scrapeMessage.No)
+            choice = scrapeMessage.question(self.view.window, "Sara", "Sara will now search the web for software from these years. Do you want to continue?", scrapeMessage.Yes | scrapeMessage.No)
 
             if choice == scrapeMessage.Yes:
-                self.startScraping(year)
+                self.startScraping(years)
             else:
-                self.view.scrapeSearchLine.setText(str(year))
+                self.view.scrapeSearchLine.setText(text)
 
-    def startScraping(self, year):
-        self.view.scrapeResultsList.clear()
-        self.scrapeThread = ScrapeThread(year)
+    def startScraping(self, years):
+        self.view.buildPage(2)
+        self.view.scrapeResults.clear()
+        self.scrapeThread = ScrapeThread(years, self.model.path, listener=self.searchCache.clear)
 
         self.view.progressBar.setValue(0)
         self.scrapeThread.progress.connect(self.updateProgressBar)
+        self.scrapeThread.resultsReady.connect(self.addResults)
 
-        self.scrapeThread.result.connect(self.addToDatabase)
-        self.scrapeThread.finished.connect(lambda: self.showResults(year))
+        self.scrapeThread.finished.connect(self.showResults)
+        self.view.setPaused(False)
+        self.view.setScraping(True)
         self.scrapeThread.start()
-
-    def updateProgressBar(self, val):
-        self.view.progressBar.setValue(self.view.progressBar.value() + val)
-
-    def addToDatabase(self, software):
-        self.model.replace(software)
-
-    def showResults(self, year):
+        self.updateMetrics()
+        self.metricsTimer.start()
+
+    def updateProgressBar(self, snapshot):
+        counts = snapshot['counts']
+        self.view.progressBar.setValue(int(snapshot['percent']))
+        self.view.progressBar.setToolTip("{} added, {} changed, {} unchanged, {} empty, {} failed".format(
+            counts.get('added', 0), counts.get('changed', 0), counts.get('unchanged', 0),
+            counts.get('placeholders', 0), counts.get('failed', 0)))
+
+    def togglePause(self):
+        if not self.isScraping():
+            return
+        control = self.scrapeThread.control
+        if control.isPaused():
+            control.resume()
+        else:
+            control.pause()
+        self.view.setPaused(control.isPaused())
+
+    def cancelScrape(self):
+        if self.isScraping():
+            self.scrapeThread.control.cancel()
+            self.view.setScraping(False)
+
+    def stopScrape(self):
+        if self.isScraping():
+            self.scrapeThread.stop()
+
+    def addResults(self):
+        self.view.scrapeResults.addSoftware(
+            [(Software(software.team, software.description, str(software.year)), None)
+             for software in self.scrapeThread.takeResults()])
+
+    def updateMetrics(self):
+        snapshot = self.scrapeThread.metrics.snapshot()
+        text = "{} of {} pages  ·  {:.1f} pages/s  ·  {:.1f} MB  ·  {} errors".format(
+            snapshot['pages'], snapshot['pagesQueued'], snapshot['pagesPerSecond'],
+            snapshot['bytes'] / 1e6, snapshot['errors'])
+        if snapshot['eta'] is not None and self.metricsTimer.isActive():
+            minutes, seconds = divmod(int(snapshot['eta']), 60)
+            text += "  ·  about {}:{:02d} left".format(minutes, seconds)
+        self.view.scrapeMetrics.setText(text)
+
+    def showResults(self):
+        self.metricsTimer.stop()
+        self.view.setScraping(False)
+        self.updateMetrics()
+        # The timings of the last scrape are kept next to the database.
+        self.scrapeThread.metrics.dump(os.path.join(
+            os.path.dirname(os.path.abspath(self.model.path)), 'scrape-report.json'))
+        self.addResults()
+        if self.scrapeThread.cancelled:
+            stopMessage = QtWidgets.QMessageBox()
+            stopMessage.question(self.view.window, "Sara", "Sara stopped searching. The software found so far is saved, and Sara will offer to finish the search the next time it starts.", stopMessage.Ok)
+            return
+        if self.scrapeThread.error is not None:
+            errorMessage = QtWidgets.QMessageBox()
+            errorMessage.question(self.view.window, "Sara", "Sara could not finish searching ({}). The software found so far is saved, and Sara will offer to finish the search the next time it starts.".format(self.scrapeThread.error), errorMessage.Ok)
+            return
         self.view.progressBar.setValue(100)
-        softwareList = self.model.getAllFromYear(year)
-        for i in softwareList:
-            software = Software(i[0], i[1], str(i[2]))
-            self.view.addToList(self.view.scrapeResultsList, software)
+        reports = self.scrapeThread.reports.values()
+        text = "Sara is finished searching. {} added, {} changed, {} unchanged, {} removed.".format(
+            sum(report['added'] for report in reports), sum(report['changed'] for report in reports),
+            sum(report['unchanged'] for report in reports), sum(report['removed'] for report in reports))
+        failed = sum(report['failed'] for report in reports)
+        if failed > 0:
+            text += " {} pages could not be read and were left as they were.".format(failed)
+        for year, report in sorted(self.scrapeThread.reports.items()):
+            if report['error'] is not None:
+                text += " " + report['error'] + "."
         finishMessage = QtWidgets.QMessageBox()
-        finishMessage.question(self.view.window, "Sara", "Sara is finished searching.", finishMessage.Ok)
+        finishMessage.question(self.view.window, "Sara", text, finishMessage.Ok)
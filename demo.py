@@ -1,10 +1,33 @@
+import time
+
+started = time.perf_counter()
+
+import multiprocessing
 import sys
 from model import Model
 from view import View
 from controller import Controller
+from PyQt5 import QtCore
+
+
+class StartupProbe(QtCore.QObject):
+    # Run with --startup-probe to print the time from launch to the first
+    # paint of the window, and quit.
+    def eventFilter(self, watched, event):
+        if event.type() == QtCore.QEvent.Paint:
+            watched.removeEventFilter(self)
+            print("First paint after {:.0f} ms".format((time.perf_counter() - started) * 1000),
+                  file=sys.stderr)
+            QtCore.QTimer.singleShot(0, QtCore.QCoreApplication.quit)
+        return False
+
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     model = Model()
     view = View()
+    if '--startup-probe' in sys.argv:
+        probe = StartupProbe()
+        view.window.installEventFilter(probe)
     controller = Controller(model, view)
     sys.exit(controller.view.app.exec_())
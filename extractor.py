@@ -0,0 +1,115 @@
+from lxml import etree
+
+textContent = etree.XPath("string()")
+
+
+class DescriptionExtractor():
+    # Builds the same description as the old BeautifulSoup path: the text
+    # of the <p> elements inside div#bodyContent, with surrounding
+    # whitespace of each line removed, skipping paragraphs that are empty
+    # or contain <script> or <style>, cut off after length characters.
+    # Pages are parsed incrementally and parsing stops as soon as the
+    # description is full or bodyContent has been closed. Paragraphs can be
+    # nested, so each one keeps its place in document order from its start
+    # tag, and none is cleared until the outermost one has closed.
+    # With a matcher, a page whose text inside bodyContent has one of its
+    # phrases before the description is done is a placeholder; the text of
+    # each element is looked at when it closes, so where the page was split
+    # into chunks does not change the outcome.
+    def __init__(self, length=500, chunkSize=16384, matcher=None):
+        self.length = length
+        self.chunkSize = chunkSize
+        self.parser = etree.HTMLPullParser(events=('start', 'end'))
+        self.body = None
+        self.paragraphs = []
+        self.texts = []
+        self.added = 0
+        self.skipped = set()
+        self.parts = []
+        self.size = 0
+        self.search = None
+        if matcher is not None and matcher.pattern is not None:
+            self.search = matcher.pattern.search
+        self.placeholder = False
+        self.done = False
+
+    def feed(self, data):
+        if self.done:
+            return True
+        self.parser.feed(data)
+        self.readEvents()
+        return self.done
+
+    def feedAll(self, source):
+        for start in range(0, len(source), self.chunkSize):
+            if self.feed(source[start:start + self.chunkSize]):
+                break
+        self.close()
+        return self.getDescription()
+
+    def close(self):
+        if not self.done:
+            try:
+                self.parser.close()
+            except etree.XMLSyntaxError:
+                pass
+            self.readEvents()
+        self.done = True
+
+    def readEvents(self):
+        for event, element in self.parser.read_events():
+            if self.done:
+                continue
+            tag = element.tag
+            if event == 'start':
+                if self.body is None:
+                    if tag == 'div' and element.get('id') == 'bodyContent':
+                        self.body = element
+                elif tag == 'p':
+                    self.paragraphs.append((element, len(self.texts)))
+                    self.texts.append(None)
+                elif tag in ('script', 'style'):
+                    self.skipped.update(paragraph for paragraph, index in self.paragraphs)
+            elif self.body is None:
+                continue
+            elif self.search is not None and tag not in ('script', 'style') and self.hasPhrase(element):
+                self.placeholder = True
+                self.done = True
+            elif element is self.body:
+                self.done = True
+            elif tag == 'p' and len(self.paragraphs) > 0 and self.paragraphs[-1][0] is element:
+                index = self.paragraphs.pop()[1]
+                self.texts[index] = "" if element in self.skipped else textContent(element)
+                self.skipped.discard(element)
+                if len(self.paragraphs) == 0:
+                    element.clear(keep_tail=True)
+                self.addParagraphs()
+            elif tag in ('script', 'style') and len(self.paragraphs) == 0:
+                element.clear(keep_tail=True)
+
+    def hasPhrase(self, element):
+        # Children have closed before their parent, so its text and their
+        # tails are complete.
+        if element.text and self.search(element.text) is not None:
+            return True
+        return any(child.tail and self.search(child.tail) is not None for child in element)
+
+    def addParagraphs(self):
+        # Paragraphs are added in order, as soon as all before them closed.
+        while not self.done and self.added < len(self.texts) and self.texts[self.added] is not None:
+            self.addParagraph(self.texts[self.added])
+            self.added += 1
+
+    def addParagraph(self, text):
+        text = "".join(line.strip() for line in text.split("\n"))
+        if len(text) == 0:
+            return
+        text = text[:self.length - self.size]
+        self.parts.append(text)
+        self.parts.append(" ")
+        self.size += len(text) + 1
+        if self.size >= self.length:
+            self.done = True
+
+    def getDescription(self):
+        return "".join(self.parts) + "..."
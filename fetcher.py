@@ -0,0 +1,136 @@
+import codecs
+import time
+from concurrent.futures import ThreadPoolExecutor
+from control import Cancelled
+from extractor import DescriptionExtractor
+from metrics import Metrics
+
+
+class Page():
+    # Collects a page as it streams in, decoding it on the way. With
+    # extract set the description is built as it arrives and reading stops
+    # once it is done, which is also when the page's placeholder check has
+    # been decided. Without, the page is only scanned for placeholder
+    # phrases; once one turns up, the part read so far is parsed after all
+    # and the rest is parsed as it arrives, so the page is judged by the
+    # same rule either way. Reading always stops once maxBytes have been
+    # read.
+    def __init__(self, link, matcher=None, maxBytes=None, extract=False):
+        self.link = link
+        self.matcher = matcher
+        self.parts = []
+        self.decoder = None
+        self.scanner = None
+        self.extractor = None
+        if extract:
+            self.extractor = DescriptionExtractor(matcher=matcher)
+        elif matcher is not None and matcher.pattern is not None:
+            self.scanner = matcher.scanner()
+        self.maxBytes = maxBytes
+        self.size = 0
+        self.probeSeconds = 0
+        self.parseSeconds = 0
+        self.placeholder = False
+        self.truncated = False
+        self.complete = False
+
+    def feed(self, chunk, encoding):
+        if self.maxBytes is not None and self.size + len(chunk) > self.maxBytes:
+            chunk = chunk[:self.maxBytes - self.size]
+            self.truncated = True
+        self.size += len(chunk)
+        if self.decoder is None:
+            self.decoder = codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+        self.addText(self.decoder.decode(chunk))
+        if self.extractor is not None and self.extractor.done:
+            self.placeholder = self.extractor.placeholder
+            self.complete = not self.placeholder
+        return self.truncated or self.extractor is not None and self.extractor.done
+
+    def addText(self, text):
+        self.parts.append(text)
+        if self.scanner is not None:
+            start = time.perf_counter()
+            found = self.scanner.feed(text)
+            self.probeSeconds += time.perf_counter() - start
+            if not found:
+                return
+            self.scanner = None
+            self.extractor = DescriptionExtractor(matcher=self.matcher)
+            text = "".join(self.parts)
+        if self.extractor is not None:
+            start = time.perf_counter()
+            self.extractor.feed(text)
+            self.parseSeconds += time.perf_counter() - start
+
+    def finish(self):
+        # Reads what the decoder held back and closes the extractor, which
+        # may still find a placeholder phrase in elements left open.
+        self.getText()
+        if self.extractor is not None:
+            start = time.perf_counter()
+            self.extractor.close()
+            self.parseSeconds += time.perf_counter() - start
+            self.placeholder = self.extractor.placeholder
+
+    def getText(self):
+        if self.decoder is not None:
+            self.addText(self.decoder.decode(b"", True))
+            self.decoder = None
+        return "".join(self.parts)
+
+    def getDescription(self):
+        self.finish()
+        return self.extractor.getDescription()
+
+
+class Fetcher():
+    def __init__(self, transport, workers=8, maxPageBytes=1024 * 1024, metrics=None):
+        self.transport = transport
+        self.workers = workers
+        self.maxPageBytes = maxPageBytes
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def fetch(self, link, matcher=None, extract=False):
+        # With extract set the description is built while the page streams
+        # in, so reading can stop as soon as it is complete. A cached page
+        # that was cut short and turns out not to be enough is read again
+        # into a new Page.
+        pages = []
+
+        def newPage():
+            pages.append(Page(link, matcher, self.maxPageBytes, extract))
+            return pages[-1].feed
+
+        start = time.perf_counter()
+        try:
+            self.transport.stream(link, newPage(), restart=newPage)
+            pages[-1].finish()
+        except Cancelled:
+            raise
+        except Exception:
+            self.metrics.count('errors')
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            probeSeconds = sum(page.probeSeconds for page in pages)
+            parseSeconds = sum(page.parseSeconds for page in pages)
+            self.metrics.count('bytes', sum(page.size for page in pages))
+            self.metrics.addTime('descriptionFetch', elapsed - probeSeconds - parseSeconds)
+            self.metrics.addTime('contentProbe', probeSeconds)
+        page = pages[-1]
+        if page.placeholder:
+            self.metrics.count('placeholders')
+        elif page.truncated:
+            self.metrics.count('truncated')
+        elif page.complete:
+            self.metrics.count('stoppedEarly')
+        return page
+
+    def close(self, wait=True):
+        # Fetches that have not started are dropped. After a cancel the
+        # running ones are not waited for; they end on their own.
+        self.executor.shutdown(wait=wait, cancel_futures=True)
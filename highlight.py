@@ -0,0 +1,4 @@
+# Markers around the matched words in search snippets. They cannot occur in
+# scraped text, so the view and the command line can swap them for bold.
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_END = "\x03"
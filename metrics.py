@@ -0,0 +1,135 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from fractions import Fraction
+
+
+class Metrics():
+    # Collects what a scrape spends its time on. Stage times are summed
+    # over all threads and parse processes, so together they can exceed
+    # the wall time. Safe to read from another thread while a scrape runs.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.firstPage = None
+        self.stages = {}
+        self.counters = {'pages': 0, 'bytes': 0, 'errors': 0}
+        self.years = 1
+        self.yearsStarted = 0
+        self.pagesQueued = 0
+        self.sources = {}
+
+    @contextmanager
+    def timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.addTime(stage, time.perf_counter() - start)
+
+    def addTime(self, stage, seconds, count=1):
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = [0, 0.0]
+            self.stages[stage][0] += count
+            self.stages[stage][1] += seconds
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def setYears(self, years):
+        with self.lock:
+            self.years = max(years, 1)
+
+    def startYear(self, pages):
+        # pages is the number of team pages the year will fetch; the ETA
+        # assumes years not started yet are as large as the average so far.
+        with self.lock:
+            self.yearsStarted += 1
+            self.pagesQueued += pages
+            if self.firstPage is None and pages > 0:
+                self.firstPage = time.monotonic()
+
+    def addSource(self, name, getStats):
+        # getStats is called for the final report, e.g. Transport.getStats.
+        self.sources[name] = getStats
+
+    def snapshot(self):
+        with self.lock:
+            now = time.monotonic()
+            pages = self.counters['pages']
+            rate = 0
+            if self.firstPage is not None and now > self.firstPage:
+                rate = pages / (now - self.firstPage)
+            eta = None
+            if rate > 0 and self.yearsStarted > 0:
+                remaining = self.pagesQueued - pages + \
+                    (self.years - self.yearsStarted) * self.pagesQueued / self.yearsStarted
+                eta = max(remaining, 0) / rate
+            return {'elapsed': now - self.started, 'pages': pages, 'pagesQueued': self.pagesQueued,
+                    'pagesPerSecond': rate, 'bytes': self.counters['bytes'],
+                    'errors': self.counters['errors'], 'eta': eta,
+                    'years': self.years, 'yearsStarted': self.yearsStarted,
+                    'counters': dict(self.counters),
+                    'stages': {stage: {'count': count, 'seconds': seconds,
+                                       'meanMs': seconds / count * 1000 if count > 0 else 0}
+                               for stage, (count, seconds) in self.stages.items()}}
+
+    def report(self):
+        report = self.snapshot()
+        for name, getStats in self.sources.items():
+            report[name] = getStats()
+        return report
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, indent=2)
+
+
+class Progress():
+    # Adds up the progress reported by the scrape threads, as an exact
+    # percentage and a count per stage, and hands snapshots of it to
+    # publish at most once per interval seconds. An update that is held
+    # back is published when the interval is over, even if nothing else
+    # comes in by then, and flush publishes whatever is left, so the last
+    # snapshot is always complete. Snapshots are published under the lock
+    # so they never arrive out of order.
+    def __init__(self, publish, interval=0.05):
+        self.publish = publish
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.percent = Fraction(0)
+        self.counts = {}
+        self.published = None
+        self.pending = False
+        self.timer = None
+
+    def add(self, amount, stage=None, count=1):
+        with self.lock:
+            self.percent += Fraction(amount)
+            if stage is not None:
+                self.counts[stage] = self.counts.get(stage, 0) + count
+            self.pending = True
+            now = time.monotonic()
+            if self.published is not None and now - self.published < self.interval:
+                if self.timer is None:
+                    self.timer = threading.Timer(self.published + self.interval - now, self.flush)
+                    self.timer.daemon = True
+                    self.timer.start()
+                return
+            self.publish(self.takeSnapshot(now))
+
+    def flush(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if self.pending:
+                self.publish(self.takeSnapshot(time.monotonic()))
+
+    def takeSnapshot(self, now):
+        self.published = now
+        self.pending = False
+        return {'percent': float(min(self.percent, 100)), 'counts': dict(self.counts)}
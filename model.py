@@ -1,38 +1,170 @@
-import operator
+import re
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from highlight import HIGHLIGHT_START, HIGHLIGHT_END
 from software import Software
 
 
 class Model:
-    def __init__(self, parent=None):
-        self.connection = sqlite3.connect('software.db')
+    # Schema versions, oldest first; see migrate.
+    migrations = ['createTables', 'indexByYear', 'recordFoundTeams', 'cacheResponses']
 
-        # self.createTable()
+    def __init__(self, path='software.db', parent=None):
+        self.path = path
+        self.listeners = []
+        # Set by a Scheduler to time database writes during a scrape.
+        self.metrics = None
+        self.connection = sqlite3.connect(path)
+        self.configure()
+        self.migrate()
 
         # self.dropTable()
 
-    def createTable(self):
-        cursor = self.connection.cursor()
-        cursor.execute("""CREATE TABLE software (
+    def configure(self):
+        # WAL lets the query and scrape threads read while a batch is being
+        # written, and with it NORMAL sync only risks the last commit on a
+        # power cut. The library is a few MB, so memory map and cache all of
+        # it.
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute("PRAGMA mmap_size = 268435456")
+        self.connection.execute("PRAGMA cache_size = -16000")
+
+    def migrate(self):
+        # The database's user_version is the number of migrations it has had.
+        # Each one runs in its own transaction together with the version bump,
+        # and the version is read again once the write lock is held, so the
+        # app and scrape threads opening a new database at once are safe.
+        while True:
+            with self.connection:
+                self.connection.execute("BEGIN IMMEDIATE")
+                version = self.connection.execute(
+                    "PRAGMA user_version").fetchone()[0]
+                if version >= len(self.migrations):
+                    break
+                getattr(self, self.migrations[version])(
+                    self.connection.cursor())
+                self.connection.execute(
+                    "PRAGMA user_version = {}".format(version + 1))
+
+    def createTables(self, cursor):
+        # Databases made before migrations existed are at version 0 with some
+        # or all of this already in place, so every step checks first.
+        cursor.execute("""CREATE TABLE IF NOT EXISTS software (
             team text,
             description text,
-            year integer
+            year integer,
+            hash text,
+            fetched real
         )""")
         cursor.execute(
-            "CREATE UNIQUE INDEX team_and_year ON software (team, year)")
-        self.connection.commit()
-        print("Created table: software")
+            "CREATE UNIQUE INDEX IF NOT EXISTS team_and_year ON software (team, year)")
+        cursor.execute("PRAGMA table_info(software)")
+        columns = [column[1] for column in cursor.fetchall()]
+        if "hash" not in columns:
+            cursor.execute("ALTER TABLE software ADD COLUMN hash text")
+        if "fetched" not in columns:
+            cursor.execute("ALTER TABLE software ADD COLUMN fetched real")
+        self.createSearchIndex(cursor)
+        cursor.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            year integer PRIMARY KEY,
+            status text,
+            updated real
+        )""")
+        cursor.execute("""CREATE TABLE IF NOT EXISTS job_teams (
+            year integer,
+            team text,
+            PRIMARY KEY (year, team)
+        )""")
+
+    def createSearchIndex(self, cursor):
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE name = 'software_search'")
+        if cursor.fetchone() is not None:
+            return
+        cursor.execute("""CREATE VIRTUAL TABLE software_search USING fts5 (
+            team,
+            description,
+            content = 'software',
+            content_rowid = 'rowid',
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )""")
+        cursor.execute("""CREATE TRIGGER software_search_insert AFTER INSERT ON software BEGIN
+            INSERT INTO software_search (rowid, team, description) VALUES (new.rowid, new.team, new.description);
+        END""")
+        cursor.execute("""CREATE TRIGGER software_search_delete AFTER DELETE ON software BEGIN
+            INSERT INTO software_search (software_search, rowid, team, description)
+                VALUES ('delete', old.rowid, old.team, old.description);
+        END""")
+        cursor.execute("""CREATE TRIGGER software_search_update AFTER UPDATE ON software BEGIN
+            INSERT INTO software_search (software_search, rowid, team, description)
+                VALUES ('delete', old.rowid, old.team, old.description);
+            INSERT INTO software_search (rowid, team, description) VALUES (new.rowid, new.team, new.description);
+        END""")
+        cursor.execute(
+            "INSERT INTO software_search (software_search) VALUES ('rebuild')")
+
+    def indexByYear(self, cursor):
+        # Every read is by year, or ordered by year then team, so the unique
+        # key leads with year: year lookups, keyset pages and the ordered
+        # listings become index seeks with no sort step. The upsert matches
+        # the key by its columns, not their order, so it keeps working.
+        cursor.execute(
+            "CREATE UNIQUE INDEX software_year_team ON software (year, team)")
+        cursor.execute("DROP INDEX team_and_year")
+        # Only the software table: statistics taken on the search index's
+        # shadow tables while they are small make the planner pick table
+        # scans for them later, which slows every write several times over.
+        cursor.execute("ANALYZE software")
+
+    def recordFoundTeams(self, cursor):
+        # Checkpoints also say whether the team's page had software, so a
+        # resumed scrape can remove the teams that lost theirs before the
+        # interruption. Older checkpoints are taken as found.
+        cursor.execute(
+            "ALTER TABLE job_teams ADD COLUMN found integer DEFAULT 1")
+
+    def cacheResponses(self, cursor):
+        # Wiki responses kept by cache.ResponseCache. It made this table
+        # itself before, so it may be there already, without complete.
+        cursor.execute("""CREATE TABLE IF NOT EXISTS http_cache (
+            url text PRIMARY KEY,
+            etag text,
+            modified text,
+            encoding text,
+            body blob,
+            size integer,
+            stored real,
+            accessed real,
+            complete integer DEFAULT 1
+        )""")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS http_cache_accessed ON http_cache (accessed)")
+        cursor.execute("PRAGMA table_info(http_cache)")
+        if "complete" not in [column[1] for column in cursor.fetchall()]:
+            cursor.execute(
+                "ALTER TABLE http_cache ADD COLUMN complete integer DEFAULT 1")
 
     def dropTable(self):
+        # Every migration runs again on the next open, so the tables they
+        # change go too. Job checkpoints only make sense with their rows.
+        # The response cache is kept; its migration copes with that.
         cursor = self.connection.cursor()
+        cursor.execute("DROP TABLE IF EXISTS software_search")
         cursor.execute("DROP TABLE IF EXISTS software")
+        cursor.execute("DROP TABLE IF EXISTS job_teams")
+        cursor.execute("DROP TABLE IF EXISTS jobs")
+        cursor.execute("PRAGMA user_version = 0")
         self.connection.commit()
         print("Dropped table: software")
 
     def checkYear(self, year):
         cursor = self.connection.cursor()
         cursor.execute(
-            "SELECT * FROM software WHERE year = :year LIMIT 1", {'year': year})
+            "SELECT year FROM software WHERE year = :year LIMIT 1", {'year': year})
         softwareList = cursor.fetchall()
         if len(softwareList) == 1:
             return True
@@ -40,27 +172,236 @@ class Model:
 
     def getAll(self):
         cursor = self.connection.cursor()
-        cursor.execute("SELECT * FROM software")
-        softwareList = cursor.fetchall()
-        softwareList = sorted(softwareList, key=operator.itemgetter(2, 0))
-        return softwareList
+        cursor.execute(
+            "SELECT team, description, year FROM software ORDER BY year, team")
+        return cursor.fetchall()
 
     def getAllFromYear(self, year):
         cursor = self.connection.cursor()
         cursor.execute(
-            "SELECT * FROM software WHERE year = :year", {'year': year})
-        softwareList = cursor.fetchall()
-        softwareList = sorted(softwareList, key=operator.itemgetter(2, 0))
-        return softwareList
+            "SELECT team, description, year FROM software WHERE year = :year ORDER BY team", {'year': year})
+        return cursor.fetchall()
+
+    def getPage(self, year=None, after=None, limit=100, years=None):
+        # Keyset pagination on (year, team): pass the (year, team) of the
+        # last row already shown as after to get the rows that follow it.
+        conditions = []
+        parameters = {'limit': limit}
+        if year is not None:
+            conditions.append("year = :year")
+            parameters['year'] = year
+        if years is not None:
+            conditions.append(
+                "year IN (" + ", ".join(str(int(year)) for year in years) + ")")
+        if after is not None:
+            conditions.append("(year, team) > (:afterYear, :afterTeam)")
+            parameters['afterYear'] = after[0]
+            parameters['afterTeam'] = after[1]
+        sql = "SELECT team, description, year FROM software"
+        if len(conditions) > 0:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY year, team LIMIT :limit"
+        cursor = self.connection.cursor()
+        cursor.execute(sql, parameters)
+        return cursor.fetchall()
+
+    def buildSearchQuery(self, text):
+        # Quoted text is matched as a phrase, every other word as a prefix.
+        # Four-digit words are taken as a year filter instead.
+        terms = []
+        years = []
+        for phrase, word in re.findall(r'"([^"]*)"?|(\S+)', text):
+            if len(word) == 4 and word.isdigit():
+                years.append(int(word))
+            elif len(word) > 0:
+                terms.append('"' + word.replace('"', '""') + '"*')
+            elif len(phrase.strip()) > 0:
+                terms.append('"' + phrase + '"')
+        return " ".join(terms), years
+
+    def search(self, text, limit=200):
+        # Rows are (rowid, team, description, year, snippet), best match
+        # first.
+        query, years = self.buildSearchQuery(text)
+        if len(query) == 0:
+            return []
+        sql = """SELECT software.rowid, software.team, software.description, software.year,
+                snippet(software_search, 1, :start, :end, '...', 40)
+            FROM software_search JOIN software ON software.rowid = software_search.rowid
+            WHERE software_search MATCH :query"""
+        if len(years) > 0:
+            sql += " AND software.year IN (" + \
+                ", ".join(str(year) for year in years) + ")"
+        sql += " ORDER BY bm25(software_search, 10.0, 1.0) LIMIT :limit"
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(sql, {'start': HIGHLIGHT_START, 'end': HIGHLIGHT_END,
+                                 'query': query, 'limit': limit})
+        except sqlite3.OperationalError:
+            return []
+        return cursor.fetchall()
+
+    def getHashes(self, year):
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "SELECT team, hash FROM software WHERE year = :year", {'year': year})
+        return dict(cursor.fetchall())
 
     def replace(self, software):
+        self.replaceMany([software])
+
+    def replaceMany(self, softwareList):
+        self.writeBatch(softwareList, [])
+
+    def writeBatch(self, softwareList, finishedTeams):
+        # Rows and the (year, team, found) job checkpoints they complete are
+        # committed together, so a resumed scrape never skips a team whose
+        # row was lost. Edits made in the app carry no hash; keep the
+        # scraped one so the next incremental scrape does not treat the row
+        # as changed.
+        start = time.perf_counter()
+        with self.connection:
+            self.connection.executemany("""INSERT INTO software (team, description, year, hash, fetched)
+                VALUES (:team, :description, :year, :hash, :fetched)
+                ON CONFLICT (team, year) DO UPDATE SET
+                    description = excluded.description,
+                    hash = COALESCE(excluded.hash, hash),
+                    fetched = COALESCE(excluded.fetched, fetched)""",
+                                        [{'team': software.team, 'description': software.description,
+                                          'year': software.year, 'hash': software.hash,
+                                          'fetched': software.fetched} for software in softwareList])
+            self.connection.executemany("INSERT OR IGNORE INTO job_teams VALUES (:year, :team, :found)",
+                                        [{'year': year, 'team': team, 'found': found}
+                                         for year, team, found in finishedTeams])
+        if self.metrics is not None:
+            self.metrics.addTime('dbWrite', time.perf_counter() - start)
+        self.notify()
+
+    def removeTeams(self, year, teams):
         cursor = self.connection.cursor()
-        cursor.execute("REPLACE INTO software VALUES (:team, :description, :year)",
-                       {'team': software.team, 'description': software.description, 'year': software.year})
+        cursor.executemany("DELETE FROM software WHERE team = :team AND year = :year",
+                           [{'team': team, 'year': year} for team in teams])
         self.connection.commit()
+        self.notify()
+
+    def queueYears(self, years):
+        # Years that were finished or failed before start over; interrupted
+        # ones keep
+        # their checkpoints so they resume.
+        now = time.time()
+        with self.connection:
+            for year in years:
+                cursor = self.connection.cursor()
+                cursor.execute(
+                    "SELECT status FROM jobs WHERE year = :year", {'year': year})
+                job = cursor.fetchone()
+                if job is None or job[0] in ('done', 'failed'):
+                    cursor.execute(
+                        "DELETE FROM job_teams WHERE year = :year", {'year': year})
+                    cursor.execute("REPLACE INTO jobs VALUES (:year, 'pending', :updated)",
+                                   {'year': year, 'updated': now})
+
+    def getUnfinishedYears(self):
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "SELECT year FROM jobs WHERE status NOT IN ('done', 'failed') ORDER BY year")
+        return [job[0] for job in cursor.fetchall()]
+
+    def getFinishedTeams(self, year):
+        # Maps each team finished so far to whether its page had software.
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "SELECT team, found FROM job_teams WHERE year = :year", {'year': year})
+        return {team: found == 1 for team, found in cursor.fetchall()}
+
+    def finishYear(self, year):
+        with self.connection:
+            self.connection.execute("UPDATE jobs SET status = 'done', updated = :updated WHERE year = :year",
+                                    {'year': year, 'updated': time.time()})
+            self.connection.execute(
+                "DELETE FROM job_teams WHERE year = :year", {'year': year})
+
+    def failYear(self, year):
+        # Not resumed; asking for the year again starts it over.
+        with self.connection:
+            self.connection.execute("UPDATE jobs SET status = 'failed', updated = :updated WHERE year = :year",
+                                    {'year': year, 'updated': time.time()})
+
+    def cancelJobs(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM jobs WHERE status != 'done'")
+            self.connection.execute(
+                "DELETE FROM job_teams WHERE year NOT IN (SELECT year FROM jobs)")
+
+    def notify(self):
+        for listener in self.listeners:
+            listener()
+
+
+class BufferedWriter:
+    def __init__(self, model, size=50, interval=500):
+        self.model = model
+        self.size = size
+        self.interval = interval
+        self.buffer = []
+        self.finished = []
+        self.flushed = time.monotonic()
+
+    def add(self, software):
+        self.buffer.append(software)
+        self.finished.append((software.year, software.team, True))
+        self.checkFlush()
+
+    def finish(self, year, team, found):
+        self.finished.append((year, team, found))
+        self.checkFlush()
+
+    def checkFlush(self):
+        # Also called while results stall, so rows and their checkpoints
+        # are never held back for much longer than interval.
+        if len(self.finished) >= self.size or (time.monotonic() - self.flushed) * 1000 >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if len(self.finished) > 0:
+            self.model.writeBatch(self.buffer, self.finished)
+            self.buffer = []
+            self.finished = []
+        self.flushed = time.monotonic()
+
+
+class QueryCache:
+    # Least recently used map of search text to result rows, so repeating
+    # a search costs no query at all. A result that was computed before the
+    # last clear() is not stored.
+    def __init__(self, size=64):
+        self.size = size
+        self.entries = OrderedDict()
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def get(self, text):
+        with self.lock:
+            if text not in self.entries:
+                return None
+            self.entries.move_to_end(text)
+            return self.entries[text]
+
+    def put(self, text, rows, version):
+        with self.lock:
+            if version != self.version:
+                return
+            self.entries[text] = rows
+            self.entries.move_to_end(text)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.version += 1
 
 
 if __name__ == '__main__':
     model = Model()
-    # model.createTable()
     # model.dropTable()
@@ -0,0 +1,187 @@
+import hashlib
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from control import Cancelled
+from extractor import DescriptionExtractor
+
+
+def hashText(wikiSource):
+    return hashlib.sha1(wikiSource.encode('utf-8')).hexdigest()
+
+
+def parsePage(link, wikiSource, knownHash, matcher=None):
+    # Runs in a parse worker process. Returns (link, hash, description):
+    # hash is None when matcher finds the page to be a placeholder, and
+    # description is None when the page is unchanged since knownHash.
+    extractor = DescriptionExtractor(matcher=matcher)
+    description = extractor.feedAll(wikiSource)
+    if extractor.placeholder:
+        return link, None, None
+    hash = hashText(wikiSource)
+    if hash == knownHash:
+        return link, hash, None
+    return link, hash, description
+
+
+def timedParse(link, wikiSource, knownHash, matcher=None):
+    start = time.perf_counter()
+    page = parsePage(link, wikiSource, knownHash, matcher)
+    return page, time.perf_counter() - start
+
+
+def describePage(page, knownHash):
+    # Same as parsePage for a page that was parsed while it was fetched.
+    # Only the part of the page that was read is hashed.
+    hash = hashText(page.getText())
+    if hash == knownHash:
+        return page.link, hash, None
+    return page.link, hash, page.getDescription()
+
+
+class Pipeline():
+    # Fetcher threads put raw pages on a bounded queue, a dispatcher thread
+    # hands them to a pool of parse processes, and parsed pages come back
+    # to the caller of run. With parseWorkers set to 0 pages are parsed by
+    # the fetcher threads as they stream in instead, which lets them stop
+    # reading a page once its description is complete. A page the fetcher
+    # had to parse anyway, to judge a placeholder phrase, skips the pool.
+    def __init__(self, fetcher, parseWorkers=None, queueSize=32, control=None):
+        self.fetcher = fetcher
+        if parseWorkers is None:
+            parseWorkers = os.cpu_count() or 1
+        self.parseWorkers = parseWorkers
+        self.queueSize = queueSize
+        self.control = control
+        self.executor = None
+        if parseWorkers > 0:
+            self.startExecutor()
+
+    def startExecutor(self):
+        # Spawned rather than forked: the scrape runs next to Qt and
+        # fetcher threads, which a fork would copy mid-flight.
+        self.executor = ProcessPoolExecutor(max_workers=self.parseWorkers,
+                                            mp_context=multiprocessing.get_context('spawn'))
+
+    def run(self, links, matcher=None, idle=None):
+        # links is a list of (link, knownHash). Yields (link, hash,
+        # description, error) in completion order, with hash None for pages
+        # that matcher finds to be placeholders. A page that could not be
+        # fetched or parsed comes with the error instead; only cancelling
+        # the scrape ends the run early. idle is called on the caller's
+        # thread whenever no page has come in for a tenth of a second. A
+        # parse process that dies fails the pages it had, and the pool is
+        # started again for the rest.
+        pages = queue.Queue(maxsize=self.queueSize)
+        results = queue.Queue()
+        stop = threading.Event()
+        metrics = self.fetcher.metrics
+        slots = threading.Semaphore(max(self.parseWorkers, 1) * 2)
+        failures = []
+
+        def put(target, item):
+            while not stop.is_set():
+                try:
+                    target.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def fetchPage(link, knownHash):
+            if stop.is_set():
+                return
+            try:
+                page = self.fetcher.fetch(link, matcher, self.executor is None)
+            except Exception as error:
+                put(pages, (link, None, knownHash, error))
+            else:
+                put(pages, (link, page, knownHash, None))
+
+        def parsed(link, future):
+            slots.release()
+            try:
+                page, seconds = future.result()
+            except Exception as error:
+                metrics.count('errors')
+                results.put((link, None, None, error))
+            else:
+                metrics.addTime('parse', seconds)
+                results.put(page + (None,))
+
+        def dispatch():
+            try:
+                dispatchPages()
+            except Exception as error:
+                failures.append(error)
+
+        def dispatchPages():
+            for i in range(len(links)):
+                item = None
+                while item is None and not stop.is_set():
+                    try:
+                        item = pages.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+                if item is None:
+                    return
+                link, page, knownHash, error = item
+                if error is not None:
+                    results.put((link, None, None, error))
+                elif page.placeholder:
+                    results.put((link, None, None, None))
+                elif page.extractor is not None:
+                    start = time.perf_counter()
+                    try:
+                        results.put(describePage(page, knownHash) + (None,))
+                    except Exception as error:
+                        metrics.count('errors')
+                        results.put((link, None, None, error))
+                    metrics.addTime('parse', page.parseSeconds + time.perf_counter() - start)
+                else:
+                    while not slots.acquire(timeout=0.1):
+                        if stop.is_set():
+                            return
+                    try:
+                        future = self.executor.submit(timedParse, link, page.getText(), knownHash, matcher)
+                    except BrokenProcessPool as error:
+                        slots.release()
+                        metrics.count('errors')
+                        results.put((link, None, None, error))
+                        self.executor.shutdown(wait=False)
+                        self.startExecutor()
+                    else:
+                        future.add_done_callback(lambda future, link=link: parsed(link, future))
+
+        futures = [self.fetcher.executor.submit(fetchPage, link, knownHash)
+                   for link, knownHash in links]
+        dispatcher = threading.Thread(target=dispatch, daemon=True)
+        dispatcher.start()
+        try:
+            for i in range(len(links)):
+                result = None
+                while result is None:
+                    try:
+                        result = results.get(timeout=0.1)
+                    except queue.Empty:
+                        if self.control is not None:
+                            self.control.check()
+                        if len(failures) > 0:
+                            raise failures[0]
+                        if idle is not None:
+                            idle()
+                if isinstance(result[3], Cancelled):
+                    raise result[3]
+                yield result
+        finally:
+            stop.set()
+            for future in futures:
+                future.cancel()
+            dispatcher.join()
+
+    def close(self, wait=True):
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,59 @@
+import json
+import os
+import re
+
+
+class PlaceholderMatcher():
+    # Finds any of a set of boilerplate phrases with one compiled pattern,
+    # either in a whole page or in a page arriving piece by piece.
+    def __init__(self, phrases):
+        self.phrases = sorted(set(phrases), key=len, reverse=True)
+        self.pattern = None
+        self.overlap = 0
+        if len(self.phrases) > 0:
+            self.pattern = re.compile(
+                "|".join(re.escape(phrase) for phrase in self.phrases))
+            self.overlap = len(self.phrases[0]) - 1
+
+    def isPlaceholder(self, text):
+        return self.pattern is not None and self.pattern.search(text) is not None
+
+    def scanner(self):
+        return PlaceholderScanner(self)
+
+
+class PlaceholderScanner():
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.tail = ""
+        self.found = False
+
+    def feed(self, text):
+        # Keeps the end of the text seen so far, so phrases split across
+        # two pieces are still found.
+        if self.found or self.matcher.pattern is None:
+            return self.found
+        window = self.tail + text
+        if self.matcher.pattern.search(window) is not None:
+            self.found = True
+        elif self.matcher.overlap > 0:
+            self.tail = window[-self.matcher.overlap:]
+        return self.found
+
+
+class Placeholders():
+    # Phrases come from a JSON file: "default" lists phrases used for every
+    # year, and a key per year adds phrases used for that year only.
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'placeholders.json')
+        with open(path, encoding='utf-8') as config:
+            self.phrases = json.load(config)
+        self.matchers = {}
+
+    def forYear(self, year):
+        if year not in self.matchers:
+            phrases = self.phrases.get('default', []) + \
+                self.phrases.get(str(year), [])
+            self.matchers[year] = PlaceholderMatcher(phrases)
+        return self.matchers[year]
@@ -0,0 +1,109 @@
+import io
+import json
+import random
+import threading
+import time
+import zipfile
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# Headers kept in an archive; the rest do not change how a page is read.
+recordedHeaders = ('Content-Type', 'ETag', 'Last-Modified', 'Location')
+
+
+class Archive():
+    # Every HTTP exchange of a scrape in one zip file: an index of status
+    # codes and headers by URL, plus one compressed member per body.
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.file = zipfile.ZipFile(path, mode, zipfile.ZIP_DEFLATED)
+        self.index = {}
+        # Bodies are numbered in the order they are stored. A URL recorded
+        # again, as happens on a retry, gets a new member and its index
+        # entry points there.
+        self.bodies = 0
+        if mode == 'r':
+            self.index = json.loads(self.file.read('index.json').decode('utf-8'))
+
+    def put(self, url, status, headers, body):
+        with self.lock:
+            name = 'bodies/{}'.format(self.bodies)
+            self.bodies += 1
+            self.file.writestr(name, body)
+            self.index[url] = {'status': status, 'headers': headers, 'body': name}
+
+    def get(self, url):
+        with self.lock:
+            entry = self.index.get(url)
+            if entry is None:
+                return None
+            return entry['status'], entry['headers'], self.file.read(entry['body'])
+
+    def close(self):
+        with self.lock:
+            if self.mode == 'w':
+                self.file.writestr('index.json', json.dumps(self.index, indent=1))
+            self.file.close()
+
+
+class RecordingAdapter(HTTPAdapter):
+    # Sends requests as usual and stores each full response in archive.
+    def __init__(self, archive, **kwargs):
+        super().__init__(**kwargs)
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        headers = {key: response.headers[key] for key in recordedHeaders if key in response.headers}
+        self.archive.put(request.url, response.status_code, headers, response.content)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    # Answers requests from archive instead of the network, after a delay
+    # of latency seconds give or take up to jitter. URLs that were not
+    # recorded get a 404.
+    def __init__(self, archive, latency=0, jitter=0, seed=0):
+        super().__init__()
+        self.archive = archive
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'replayed': 0, 'missing': 0}
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        with self.lock:
+            delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        entry = self.archive.get(request.url)
+        if entry is None:
+            status, headers, body = 404, {}, b""
+        else:
+            status, headers, body = entry
+            if status == 200 and 'ETag' in headers and \
+                    request.headers.get('If-None-Match') == headers['ETag']:
+                status, body = 304, b""
+        with self.lock:
+            self.stats['replayed' if entry is not None else 'missing'] += 1
+
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = io.BytesIO(body)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        if not stream:
+            response.content
+        return response
+
+    def close(self):
+        pass
@@ -0,0 +1,191 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import sys
+from highlight import HIGHLIGHT_START, HIGHLIGHT_END
+from model import Model
+
+# Headless entry point: python -m sara scrape|search|export. Nothing here
+# imports PyQt5, and the scraping modules are only loaded for scrape.
+
+
+class ProgressPrinter():
+    def __init__(self, stream):
+        self.stream = stream
+
+    def update(self, snapshot):
+        counts = snapshot['counts']
+        self.stream.write("\r{:3d}%  {} added, {} changed, {} unchanged".format(
+            int(snapshot['percent']), counts.get('added', 0), counts.get('changed', 0),
+            counts.get('unchanged', 0)))
+        self.stream.flush()
+
+    def done(self):
+        self.stream.write("\r\033[K")
+        self.stream.flush()
+
+
+def scrape(model, args):
+    from cache import ResponseCache
+    from scheduler import Scheduler, parseYears
+    from transport import AdaptiveLimit, Transport
+
+    years = parseYears(" ".join(args.years)) if len(args.years) > 0 else []
+    if args.forget_queued:
+        model.cancelJobs()
+    if len(years) == 0 and len(model.getUnfinishedYears()) == 0:
+        print("Nothing to resume; give the years to scrape.", file=sys.stderr)
+        return 2
+
+    limit = None if args.fixed_concurrency else AdaptiveLimit(args.workers)
+    archive = None
+    if args.record is not None:
+        # Recording bypasses the response cache so every page is fetched
+        # and stored whole.
+        from replay import Archive, RecordingAdapter
+        archive = Archive(args.record, 'w')
+        transport = Transport(poolSize=args.workers,
+                              adapter=RecordingAdapter(archive, pool_connections=4, pool_maxsize=args.workers),
+                              limit=limit)
+    else:
+        transport = Transport(poolSize=args.workers, cache=ResponseCache(args.db),
+                              cacheOnly=args.offline, limit=limit)
+    progress = ProgressPrinter(sys.stderr)
+
+    def showResult(software):
+        if not args.quiet:
+            print("{}\t{}".format(software.year, software.team))
+
+    scheduler = Scheduler(model, progress.update if sys.stderr.isatty() else lambda snapshot: None,
+                          showResult, args.workers, transport, args.parse_workers, args.queue_size,
+                          args.max_page_kb * 1024)
+    metrics = scheduler.metrics
+    try:
+        scheduler.run(years)
+    finally:
+        if archive is not None:
+            archive.close()
+        if sys.stderr.isatty():
+            progress.done()
+        for year, report in sorted(scheduler.reports.items()):
+            if report['error'] is not None:
+                print("{}: failed: {}".format(year, report['error']), file=sys.stderr)
+                continue
+            print("{}: {} added, {} changed, {} unchanged, {} removed, {} failed".format(
+                year, report['added'], report['changed'], report['unchanged'], report['removed'],
+                report['failed']), file=sys.stderr)
+            if len(report['failedTeams']) > 0:
+                print("  failed: " + ", ".join(report['failedTeams']), file=sys.stderr)
+        snapshot = metrics.snapshot()
+        print("{} pages, {:.1f} MB in {:.1f} s ({:.1f} pages/s), {} errors".format(
+            snapshot['pages'], snapshot['bytes'] / 1e6, snapshot['elapsed'], snapshot['pagesPerSecond'],
+            snapshot['errors']), file=sys.stderr)
+        if args.report is not None:
+            metrics.dump(args.report)
+    return 0
+
+
+def search(model, args):
+    text = " ".join(args.text)
+    if text.isdigit():
+        for team, description, year in model.getAllFromYear(int(text)):
+            print("{}\t{}\t{}".format(year, team, description))
+        return 0
+    start, end = ("\033[1m", "\033[0m") if sys.stdout.isatty() else ("", "")
+    for rowid, team, description, year, snippet in model.search(text, args.limit):
+        print("{}\t{}\t{}".format(year, team, snippet.replace(
+            HIGHLIGHT_START, start).replace(HIGHLIGHT_END, end)))
+    return 0
+
+
+def export(model, args):
+    years = None
+    if args.years is not None:
+        from scheduler import parseYears
+        years = parseYears(args.years)
+    output = open(args.output, 'w', newline='', encoding='utf-8') if args.output is not None else sys.stdout
+    try:
+        if args.format == 'csv':
+            writer = csv.writer(output)
+            writer.writerow(['team', 'description', 'year'])
+        else:
+            output.write("[")
+        first = True
+        after = None
+        while True:
+            softwareList = model.getPage(None, after, 1000, years)
+            for team, description, year in softwareList:
+                if args.format == 'csv':
+                    writer.writerow([team, description, year])
+                else:
+                    output.write(("\n" if first else ",\n") + json.dumps(
+                        {'team': team, 'description': description, 'year': year}))
+                first = False
+            if len(softwareList) < 1000:
+                break
+            after = (softwareList[-1][2], softwareList[-1][0])
+        if args.format == 'json':
+            output.write("\n]\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="sara", description="Software Aggregator Research Assistant")
+    parser.add_argument("--db", default="software.db",
+                        help="library database (default: software.db)")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    scrapeParser = commands.add_parser(
+        "scrape", help="search the web for software from some years")
+    scrapeParser.add_argument("years", nargs="*",
+                              help="years, ranges or lists such as 2016-2018; none resumes an interrupted run")
+    scrapeParser.add_argument("--forget-queued", action="store_true",
+                              help="drop years left queued by an interrupted run instead of resuming them")
+    scrapeParser.add_argument("--workers", type=int, default=8,
+                              help="most pages fetched at the same time (default: 8)")
+    scrapeParser.add_argument("--fixed-concurrency", action="store_true",
+                              help="always fetch --workers pages at a time instead of adapting to the server")
+    scrapeParser.add_argument("--parse-workers", type=int, default=0,
+                              help="processes parsing whole pages (default: 0, parse pages as they stream in)")
+    scrapeParser.add_argument("--queue-size", type=int, default=32,
+                              help="fetched pages waiting to be parsed (default: 32)")
+    scrapeParser.add_argument("--max-page-kb", type=int, default=1024,
+                              help="stop reading a page after this many kilobytes (default: 1024)")
+    scrapeParser.add_argument("--offline", action="store_true",
+                              help="only use pages from the response cache")
+    scrapeParser.add_argument("--record", metavar="ARCHIVE",
+                              help="save every response to this zip file for benchmarks/scrape.py")
+    scrapeParser.add_argument("--report", metavar="FILE",
+                              help="write timings and counts for the scrape to this JSON file")
+    scrapeParser.add_argument("--quiet", action="store_true",
+                              help="do not list teams as they are found")
+    scrapeParser.set_defaults(run=scrape)
+
+    searchParser = commands.add_parser(
+        "search", help="search the library by team, description or year")
+    searchParser.add_argument("text", nargs="+")
+    searchParser.add_argument("--limit", type=int, default=50)
+    searchParser.set_defaults(run=search)
+
+    exportParser = commands.add_parser("export", help="write the library out")
+    exportParser.add_argument("--format", choices=["csv", "json"], default="csv")
+    exportParser.add_argument("--years", help="only these years, e.g. 2016-2018")
+    exportParser.add_argument("--output", "-o", help="file to write instead of standard output")
+    exportParser.set_defaults(run=export)
+
+    args = parser.parse_args(argv)
+    try:
+        return args.run(Model(args.db), args)
+    except ValueError as error:
+        parser.error(str(error))
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,101 @@
+import re
+from fractions import Fraction
+from metrics import Metrics, Progress
+from model import BufferedWriter
+from scraper import Scraper, YearUnavailable
+from software import Software
+
+
+def parseYears(text):
+    # Accepts single years, ranges and lists, e.g. "2014", "2014-2016" or
+    # "2012, 2014-2016".
+    years = []
+    for part in re.split(r'[,\s]+', re.sub(r'\s*-\s*', '-', text.strip())):
+        if len(part) == 0:
+            continue
+        match = re.fullmatch(r'(\d{4})(?:-(\d{4}))?', part)
+        if match is None:
+            raise ValueError('Not a year or range of years: ' + part)
+        first = int(match.group(1))
+        last = int(match.group(2)) if match.group(2) is not None else first
+        if last < first:
+            raise ValueError('Range of years is backwards: ' + part)
+        for year in range(first, last + 1):
+            if year not in years:
+                years.append(year)
+    if len(years) == 0:
+        raise ValueError('No years given')
+    return years
+
+
+class Scheduler():
+    def __init__(self, model, progress, result, workers=8, transport=None, parseWorkers=0, queueSize=32,
+                 maxPageBytes=1024 * 1024, metrics=None, control=None):
+        self.model = model
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
+        model.metrics = metrics
+        # progress receives snapshots like {'percent': 42.5, 'counts':
+        # {'added': 3, ...}}, at most 20 a second.
+        self.progress = Progress(progress)
+        self.result = result
+        self.writer = BufferedWriter(model)
+        self.scraper = Scraper(self.updateProgress, self.addResult, workers,
+                               transport, self.writer.finish, parseWorkers, queueSize,
+                               maxPageBytes=maxPageBytes, metrics=metrics, control=control,
+                               unchanged=self.showStored, idle=self.writer.checkFlush)
+        self.control = self.scraper.control
+        self.yearCount = 1
+        self.reports = {}
+        self.stored = {}
+
+    def updateProgress(self, value, stage=None, count=1):
+        self.progress.add(Fraction(value) / self.yearCount, stage, count)
+
+    def addResult(self, software):
+        self.writer.add(software)
+        self.result(software)
+
+    def showStored(self, year, team):
+        # Teams that need no writing are still results of the scrape, so
+        # they are passed on from what is stored.
+        self.result(Software(team, self.stored[team], year))
+
+    def run(self, years):
+        # Runs the given years together with any left unfinished by an
+        # earlier, interrupted run. Finished teams are never fetched again.
+        # A cancelled run raises Cancelled after saving what it has found,
+        # and its year is left for the next run to resume. A year whose
+        # list of teams cannot be read is marked failed, with the reason in
+        # its report, and the other years go on.
+        self.model.queueYears(years)
+        queued = self.model.getUnfinishedYears()
+        self.yearCount = max(len(queued), 1)
+        self.metrics.setYears(len(queued))
+        try:
+            for year in queued:
+                skip = self.model.getFinishedTeams(year)
+                self.stored = {row[0]: row[1] for row in self.model.getAllFromYear(year)}
+                for team in sorted(skip):
+                    if skip[team] and team in self.stored:
+                        self.showStored(year, team)
+                try:
+                    self.scraper.scrape(year, self.model.getHashes(year), skip)
+                except YearUnavailable as error:
+                    self.scraper.report['error'] = str(error)
+                    self.reports[year] = self.scraper.report
+                    self.model.failYear(year)
+                    self.progress.flush()
+                    continue
+                self.writer.flush()
+                self.model.removeTeams(
+                    year, self.scraper.report['removedTeams'])
+                self.model.finishYear(year)
+                self.reports[year] = self.scraper.report
+                self.progress.flush()
+        finally:
+            self.progress.flush()
+            self.writer.flush()
+            self.scraper.close()
+        return queued
@@ -1,74 +1,144 @@
+import time
+from fractions import Fraction
 import requests
-import re
 from bs4 import BeautifulSoup
+from cache import ResponseCache
+from control import ScrapeControl
+from fetcher import Fetcher
+from metrics import Metrics
+from pipeline import Pipeline
+from placeholder import Placeholders
 from software import Software
+from transport import AdaptiveLimit, Transport
+
+
+class YearUnavailable(Exception):
+    pass
 
 
 class Scraper():
-    def __init__(self, progress, result):
+    # progress(amount, stage=None, count=1) is called with the percentage
+    # of the year just done, out of 100, and the stage whose count grew.
+    def __init__(self, progress, result, workers=8, transport=None, teamFinished=None,
+                 parseWorkers=0, queueSize=32, placeholders=None, maxPageBytes=1024 * 1024,
+                 metrics=None, control=None, unchanged=None, idle=None):
         self.progress = progress
         self.result = result
+        self.teamFinished = teamFinished
+        # unchanged(year, team) is called for teams whose stored row is
+        # still current.
+        self.unchanged = unchanged
+        # idle() is called while no page is coming in, on the thread that
+        # runs scrape.
+        self.idle = idle
+        # A transport passed in is expected to share control with the
+        # scraper, and is left open by close.
+        if control is None:
+            control = ScrapeControl() if transport is None else transport.control
+        self.control = control
+        self.ownsTransport = transport is None
+        if transport is None:
+            transport = Transport(poolSize=workers, cache=ResponseCache(), control=control,
+                                  limit=AdaptiveLimit(workers))
+        self.transport = transport
+        if placeholders is None:
+            placeholders = Placeholders()
+        self.placeholders = placeholders
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
+        self.metrics.addSource('transport', self.transport.getStats)
+        if getattr(self.transport, 'limit', None) is not None:
+            self.metrics.addSource('concurrency', self.transport.limit.getStats)
+        self.fetcher = Fetcher(self.transport, workers, maxPageBytes, metrics)
+        self.pipeline = Pipeline(self.fetcher, parseWorkers, queueSize, self.control)
+        self.report = {}
 
-    def scrape(self, year):
-        self.progress.emit(11)
-        teamWikisPageSource = requests.get(
-            'http://igem.org/Team_Wikis?year=' + str(year)).text
-        teamWikisPageSoup = BeautifulSoup(teamWikisPageSource, 'lxml')
+    def scrape(self, year, knownHashes=None, skip=None):
+        # knownHashes maps the teams already stored to their hash, None for
+        # rows that have none. skip maps teams finished by an interrupted run
+        # to whether their page had software.
+        if knownHashes is None:
+            knownHashes = {}
+        if skip is None:
+            skip = {}
+        self.report = {'added': 0, 'changed': 0, 'unchanged': 0, 'removed': 0,
+                       'removedTeams': [], 'failed': 0, 'failedTeams': [], 'error': None}
+        self.control.waitIfPaused()
+        with self.metrics.timed('indexFetch'):
+            try:
+                teamWikisPage = self.transport.get(
+                    'http://igem.org/Team_Wikis?year=' + str(year))
+            except requests.RequestException as error:
+                raise YearUnavailable('Could not fetch the list of teams for {}: {}'.format(year, error))
+        self.progress(11, 'indexes')
+        teamWikisPageSoup = BeautifulSoup(teamWikisPage.text, 'lxml')
         teamWikisPageContent = teamWikisPageSoup.find('div', id='content_Page')
+        if teamWikisPageContent is None:
+            raise YearUnavailable('No list of teams for {} (HTTP {})'.format(
+                year, teamWikisPage.status_code))
         links = self.getLinks(teamWikisPageContent)
-        linksWithContent = self.getLinksWithContent(links)
-        self.getLinkDescriptions(linksWithContent, year)
+        self.progress(22, 'links', len(links))
+        links = [link for link in links if self.getTeam(link) not in skip]
+        self.metrics.startYear(len(links))
+        if len(links) == 0:
+            self.progress(67)
+        seen = self.getLinkDescriptions(links, year, knownHashes)
+        seen.update(team for team, found in skip.items() if found)
+        self.report['removedTeams'] = sorted(set(knownHashes) - seen)
+        self.report['removed'] = len(self.report['removedTeams'])
 
     def getLinks(self, teamWikisPageContent):
-        totalTeams = int(
-            re.search(r'\d+', teamWikisPageContent.find('big').get_text()).group())
         links = []
         for link in teamWikisPageContent.findAll('a'):
             links.append(link['href'] + "/Software")
-            self.progress.emit(22 / totalTeams)
         return links
 
-    def getLinksWithContent(self, links):
-        linksWithContent = []
-        for i in range(0, len(links), 1):
-            wikiSource = requests.get(links[i]).text
-            if "There is currently no text in this page." in wikiSource or "In order to be considered for the" in \
-                    wikiSource or "you must fill this page." in wikiSource or "This page is used by the judges to " \
-                    "evaluate your team for the" in wikiSource or "Regardless of the topic, iGEM projects often create " \
-                    "or adapt computational tools to move the project forward." in wikiSource:
-                pass
-            else:
-                linksWithContent.append(links[i])
-            self.progress.emit(33 / len(links))
-        return linksWithContent
+    def getTeam(self, link):
+        return link.split("/")[3].split(":")[1]
+
+    def close(self):
+        # A cancelled scrape does not wait for pages still being fetched or
+        # parsed, whose results would be thrown away.
+        wait = not self.control.isCancelled()
+        self.fetcher.close(wait)
+        self.pipeline.close(wait)
+        if self.ownsTransport:
+            self.transport.close()
 
-    def getLinkDescriptions(self, linksWithContent, year):
-        for i in range(0, len(linksWithContent), 1):
-            description = ""
-            wikiWithContentSource = requests.get(linksWithContent[i]).text
-            wikiWithContentSoup = BeautifulSoup(wikiWithContentSource, 'lxml')
-            wikiWithContentContent = wikiWithContentSoup.find(
-                'div', id='bodyContent')
-            paragraphs = []
-            for paragraph in wikiWithContentContent.findAll('p'):
-                temp = "".join(line.strip()
-                               for line in paragraph.text.split("\n"))
-                if "<style" in str(paragraph) or "</style>" in str(paragraph) or "<script" in str(paragraph) or \
-                        "</script>" in str(paragraph) or len(temp) == 0:
-                    pass
+    def getLinkDescriptions(self, links, year, knownHashes):
+        # Each /Software page is downloaded once and parsed as it streams
+        # in, or in a worker process with parseWorkers set; results arrive
+        # in completion order. Teams that are not
+        # passed to result are handed to teamFinished, with whether their page
+        # had software, so that a resumed scrape can skip them too. A team
+        # whose page failed keeps what is stored for it and is not
+        # checkpointed, so a resumed scrape tries it again.
+        seen = set()
+        pages = [(link, knownHashes.get(self.getTeam(link))) for link in links]
+        for link, hash, description, error in self.pipeline.run(pages, self.placeholders.forYear(year), self.idle):
+            self.metrics.count('pages')
+            team = self.getTeam(link)
+            if error is not None:
+                seen.add(team)
+                self.report['failed'] += 1
+                self.report['failedTeams'].append(team)
+                self.progress(Fraction(67, len(links)), 'failed')
+                continue
+            emitted = False
+            outcome = 'placeholders'
+            if hash is not None:
+                seen.add(team)
+                if description is None:
+                    outcome = 'unchanged'
+                    if self.unchanged is not None:
+                        self.unchanged(year, team)
                 else:
-                    paragraphs.append("".join(line.strip()
-                                              for line in paragraph.text.split("\n")))
-            j = 0
-            while len(description) < 500 and j < len(paragraphs):
-                k = 0
-                while len(description) < 500 and k < len(paragraphs[j]):
-                    description += paragraphs[j][k]
-                    k += 1
-                j += 1
-                description += " "
-            description += "..."
-            software = Software(linksWithContent[i].split(
-                "/")[3].split(":")[1], description, year)
-            self.result.emit(software)
-            self.progress.emit(33 / len(linksWithContent))
+                    outcome = 'changed' if team in knownHashes else 'added'
+                    self.result(Software(team, description, year, hash, time.time()))
+                    emitted = True
+                self.report[outcome] += 1
+            if not emitted and self.teamFinished is not None:
+                self.teamFinished(year, team, hash is not None)
+            self.progress(Fraction(67, len(links)), outcome)
+        return seen
@@ -1,5 +1,7 @@
 class Software:
-    def __init__(self, team, description, year):
+    def __init__(self, team, description, year, hash=None, fetched=None):
         self.team = team
         self.description = description
         self.year = year
+        self.hash = hash
+        self.fetched = fetched
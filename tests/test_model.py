@@ -0,0 +1,87 @@
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from cache import ResponseCache
+from model import Model
+from software import Software
+
+
+class MigrationTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def open(self, path):
+        model = Model(path)
+        self.addCleanup(model.connection.close)
+        return model
+
+    def names(self, model):
+        return {row[0] for row in model.connection.execute("SELECT name FROM sqlite_master")}
+
+    def version(self, model):
+        return model.connection.execute("PRAGMA user_version").fetchone()[0]
+
+    def testShippedDatabase(self):
+        # The software.db in the repository predates migrations.
+        path = os.path.join(self.directory, 'software.db')
+        shutil.copy(os.path.join(root, 'software.db'), path)
+        with sqlite3.connect(path) as connection:
+            rows = connection.execute("SELECT team, description, year FROM software ORDER BY year, team").fetchall()
+        connection.close()
+
+        model = self.open(path)
+        self.assertEqual(self.version(model), len(Model.migrations))
+        self.assertEqual([row[:3] for row in model.getAll()], rows)
+        names = self.names(model)
+        self.assertLessEqual({'software_search', 'software_year_team', 'jobs', 'job_teams', 'http_cache'}, names)
+        self.assertNotIn('team_and_year', names)
+
+        team, description, year = rows[0]
+        self.assertIn(team, [row[1] for row in model.search(team)])
+        model.queueYears([year])
+        model.writeBatch([Software(team, 'New', year, 'h')], [(year, team, True)])
+        self.assertEqual(model.getFinishedTeams(year), {team: 1})
+
+        # Opening it again changes nothing.
+        model.connection.close()
+        model = self.open(path)
+        self.assertEqual(self.version(model), len(Model.migrations))
+
+    def testDropTable(self):
+        path = os.path.join(self.directory, 'software.db')
+        model = self.open(path)
+        model.replaceMany([Software('A', 'Tool', 2030, 'a')])
+        model.queueYears([2030])
+        model.dropTable()
+        model.connection.close()
+
+        model = self.open(path)
+        self.assertEqual(self.version(model), len(Model.migrations))
+        self.assertEqual(model.getAll(), [])
+        self.assertEqual(model.getUnfinishedYears(), [])
+
+    def testCacheMadeBeforeItsMigration(self):
+        path = os.path.join(self.directory, 'software.db')
+        with sqlite3.connect(path) as connection:
+            connection.execute("""CREATE TABLE http_cache (url text PRIMARY KEY, etag text, modified text,
+                encoding text, body blob, size integer, stored real, accessed real)""")
+        connection.close()
+
+        cache = ResponseCache(path)
+        self.addCleanup(cache.connection.close)
+        cache.put('http://igem.org/', None, None, 'utf-8', b"Part", complete=False)
+        self.assertFalse(cache.get('http://igem.org/')['complete'])
+        self.assertEqual(self.version(self.open(path)), len(Model.migrations))
+
+
+if __name__ == '__main__':
+    unittest.main()
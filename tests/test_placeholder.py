@@ -0,0 +1,99 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extractor import DescriptionExtractor
+from fetcher import Page
+from pipeline import parsePage
+from placeholder import PlaceholderMatcher
+
+phrase = "There is currently no text in this page."
+
+
+def feedInPieces(target, text, size, *args):
+    for start in range(0, len(text), size):
+        if target.feed(text[start:start + size], *args):
+            return True
+    return False
+
+
+def wiki(body, before="", after=""):
+    return '<html><body>{}<div id="bodyContent">{}</div>{}</body></html>'.format(before, body, after)
+
+
+class PlaceholderScannerTest(unittest.TestCase):
+    def setUp(self):
+        self.matcher = PlaceholderMatcher([phrase, "you must fill this page."])
+
+    def testPhraseSplitAtEveryPoint(self):
+        text = "<p>Hello. " + phrase + " More.</p>"
+        for split in range(1, len(text)):
+            scanner = self.matcher.scanner()
+            found = scanner.feed(text[:split]) or scanner.feed(text[split:])
+            self.assertTrue(found, split)
+
+    def testPhraseSplitAcrossManyPieces(self):
+        text = "x" * 100 + phrase + "y" * 100
+        for size in (1, 2, 7, 39, 40):
+            self.assertTrue(feedInPieces(self.matcher.scanner(), text, size), size)
+
+    def testNoPhrase(self):
+        text = "There is currently some text in this page."
+        for size in (1, 5, len(text)):
+            self.assertFalse(feedInPieces(self.matcher.scanner(), text, size), size)
+
+    def testNoPhrases(self):
+        matcher = PlaceholderMatcher([])
+        self.assertIsNone(matcher.pattern)
+        self.assertFalse(matcher.scanner().feed(phrase))
+
+
+class PlaceholderPageTest(unittest.TestCase):
+    # A page is a placeholder when one of the phrases is in the text inside
+    # bodyContent before the description is done, however it is read.
+    def setUp(self):
+        self.matcher = PlaceholderMatcher([phrase])
+        self.full = "<p>" + "word " * 120 + "</p>"
+
+    def judge(self, html):
+        outcomes = set()
+        for size in (1, 3, 64, len(html)):
+            extractor = DescriptionExtractor(matcher=self.matcher)
+            feedInPieces(extractor, html, size)
+            extractor.close()
+            outcomes.add(extractor.placeholder)
+            for extract in (True, False):
+                page = Page('link', self.matcher, extract=extract)
+                feedInPieces(page, html.encode('utf-8'), size, 'utf-8')
+                page.finish()
+                outcomes.add(page.placeholder)
+        outcomes.add(parsePage('link', html, None, self.matcher)[1] is None)
+        self.assertEqual(len(outcomes), 1, html)
+        return outcomes.pop()
+
+    def testPhraseInBodyContent(self):
+        self.assertTrue(self.judge(wiki("<p>" + phrase + "</p>")))
+        self.assertTrue(self.judge(wiki("<div><b>Note</b> " + phrase + "</div>" + self.full)))
+
+    def testPhraseOutsideBodyContent(self):
+        self.assertFalse(self.judge(wiki("<p>Our tool.</p>", before="<p>" + phrase + "</p>")))
+        self.assertFalse(self.judge(wiki("<p>Our tool.</p>", after="<p>" + phrase + "</p>")))
+
+    def testPhraseAfterFullDescription(self):
+        self.assertFalse(self.judge(wiki(self.full + "<p>" + phrase + "</p>")))
+
+    def testPhraseInScript(self):
+        self.assertFalse(self.judge(wiki('<script>var a = "' + phrase + '";</script><p>Our tool.</p>')))
+
+    def testPageStopsOnceDecided(self):
+        html = wiki(self.full + "<p>" + "more " * 5000 + "</p>").encode('utf-8')
+        page = Page('link', self.matcher, extract=True)
+        self.assertTrue(feedInPieces(page, html, 1024, 'utf-8'))
+        self.assertTrue(page.complete)
+        self.assertLess(page.size, len(html))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model import Model
+from replay import Archive, ReplayAdapter
+from scheduler import Scheduler, parseYears
+from software import Software
+from transport import Transport
+
+
+def page(team):
+    return '<html><body><div id="bodyContent"><p>{} builds a <b>tool</b>.</p></div></body></html>'.format(team)
+
+
+def writeArchive(path, years):
+    # years maps each year to {team: (status, body)}; a year mapped to None
+    # has no list of teams.
+    archive = Archive(path, 'w')
+    headers = {'Content-Type': 'text/html; charset=utf-8'}
+    for year, teams in years.items():
+        if teams is None:
+            continue
+        links = "".join('<a href="http://{}.igem.org/Team:{}">{}</a>'.format(year, team, team) for team in teams)
+        archive.put('http://igem.org/Team_Wikis?year={}'.format(year), 200, headers,
+                    '<html><body><div id="content_Page">{}</div></body></html>'.format(links).encode('utf-8'))
+        for team, (status, body) in teams.items():
+            if body is not None:
+                archive.put('http://{}.igem.org/Team:{}/Software'.format(year, team), status, headers,
+                            body.encode('utf-8'))
+    archive.close()
+
+
+class ParseYearsTest(unittest.TestCase):
+    def testSingleYear(self):
+        self.assertEqual(parseYears("2016"), [2016])
+
+    def testRangesAndLists(self):
+        self.assertEqual(parseYears("2012, 2014 - 2016"), [2012, 2014, 2015, 2016])
+        self.assertEqual(parseYears(" 2014-2015 2018 "), [2014, 2015, 2018])
+
+    def testYearsOnlyOnce(self):
+        self.assertEqual(parseYears("2015, 2014-2016, 2015"), [2015, 2014, 2016])
+
+    def testRejectsBadInput(self):
+        for text in ("", " , ", "16", "2016-2014", "2016-", "twenty"):
+            with self.assertRaises(ValueError):
+                parseYears(text)
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.model = Model(os.path.join(self.directory, 'software.db'))
+        self.addCleanup(self.model.connection.close)
+        self.results = []
+
+    def scheduler(self, years):
+        path = os.path.join(self.directory, 'scrape.zip')
+        writeArchive(path, years)
+        archive = Archive(path)
+        self.addCleanup(archive.close)
+        self.adapter = ReplayAdapter(archive)
+        transport = Transport(rate=1000, burst=1000, backoff=0, retries=1, adapter=self.adapter)
+        return Scheduler(self.model, lambda snapshot: None, self.results.append, workers=2,
+                         transport=transport)
+
+    def stored(self, year):
+        return {row[0]: row[1] for row in self.model.getAllFromYear(year)}
+
+    def testScrapeAddsTeamsAndRemovesGoneOnes(self):
+        self.model.replaceMany([Software('Gone', 'An edit without a hash', 2030)])
+        scheduler = self.scheduler({2030: {'A': (200, page('A')), 'B': (200, page('B'))}})
+        scheduler.run([2030])
+        self.assertEqual(self.stored(2030), {'A': 'A builds a tool. ...', 'B': 'B builds a tool. ...'})
+        self.assertEqual(scheduler.reports[2030]['removedTeams'], ['Gone'])
+        self.assertEqual(self.model.getUnfinishedYears(), [])
+
+    def testResumeSkipsFinishedTeams(self):
+        # An interrupted run had finished A, whose page had software, and B,
+        # whose page had become a placeholder by then.
+        self.model.replaceMany([Software('A', 'Stored', 2030, 'a'), Software('B', 'Old', 2030, 'b'),
+                                Software('Gone', 'Old', 2030, 'g')])
+        self.model.queueYears([2030])
+        self.model.writeBatch([], [(2030, 'A', True), (2030, 'B', False)])
+        scheduler = self.scheduler({2030: {'A': (200, None), 'B': (200, None), 'C': (200, page('C'))}})
+        self.assertEqual(scheduler.run([]), [2030])
+        self.assertEqual(self.adapter.stats, {'replayed': 2, 'missing': 0})
+        self.assertEqual(self.stored(2030), {'A': 'Stored', 'C': 'C builds a tool. ...'})
+        self.assertEqual(scheduler.reports[2030]['removedTeams'], ['B', 'Gone'])
+        self.assertEqual(sorted(software.team for software in self.results), ['A', 'C'])
+        self.assertEqual(self.model.getFinishedTeams(2030), {})
+
+    def testFailedPageKeepsItsRow(self):
+        self.model.replaceMany([Software('A', 'Stored', 2030, 'a')])
+        scheduler = self.scheduler({2030: {'A': (503, 'Busy'), 'B': (200, page('B'))}})
+        scheduler.run([2030])
+        report = scheduler.reports[2030]
+        self.assertEqual((report['failed'], report['failedTeams'], report['removedTeams']), (1, ['A'], []))
+        self.assertEqual(self.stored(2030)['A'], 'Stored')
+
+    def testUnreadableYearDoesNotBlockTheOthers(self):
+        scheduler = self.scheduler({2029: None, 2030: {'A': (200, page('A'))}})
+        scheduler.run([2029, 2030])
+        self.assertIsNotNone(scheduler.reports[2029]['error'])
+        self.assertEqual(list(self.stored(2030)), ['A'])
+        self.assertEqual(self.model.getUnfinishedYears(), [])
+
+        self.model.queueYears([2029])
+        self.assertEqual(self.model.getUnfinishedYears(), [2029])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import os
+import random
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import CacheMiss, ResponseCache
+from replay import Archive, ReplayAdapter
+from transport import AdaptiveLimit, Transport
+
+url = 'http://2030.igem.org/Team:A/Software'
+body = b"".join(b"line %d\n" % i for i in range(1000))
+
+
+class Reader():
+    # Takes chunks until it has wanted bytes, or the whole body.
+    def __init__(self, wanted=None):
+        self.wanted = wanted
+        self.chunks = []
+
+    def feed(self, chunk, encoding):
+        self.chunks.append(chunk)
+        return self.wanted is not None and len(self.getBody()) >= self.wanted
+
+    def getBody(self):
+        return b"".join(self.chunks)
+
+
+class StreamCacheTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'scrape.zip')
+        archive = Archive(path, 'w')
+        archive.put(url, 200, {'Content-Type': 'text/plain; charset=utf-8', 'ETag': '"1"'}, body)
+        archive.close()
+        archive = Archive(path)
+        self.addCleanup(archive.close)
+        self.adapter = ReplayAdapter(archive)
+        self.cache = ResponseCache(os.path.join(directory.name, 'software.db'))
+        self.addCleanup(self.cache.connection.close)
+
+    def transport(self, **kwargs):
+        return Transport(rate=1000, burst=1000, cache=self.cache, adapter=self.adapter, **kwargs)
+
+    def storePart(self):
+        reader = Reader(100)
+        self.transport().stream(url, reader.feed, chunkSize=256)
+        entry = self.cache.get(url)
+        self.assertFalse(entry['complete'])
+        self.assertEqual(entry['body'], body[:256])
+
+    def testPartIsNotFedWithoutRestart(self):
+        self.storePart()
+        reader = Reader()
+        self.transport().stream(url, reader.feed, chunkSize=256)
+        self.assertEqual(reader.getBody(), body)
+        self.assertTrue(self.cache.get(url)['complete'])
+
+    def testPartServesReaderThatStopsWithinIt(self):
+        self.storePart()
+        reader = Reader(200)
+        restarts = []
+        self.transport(maxAge=3600).stream(url, reader.feed, chunkSize=256, restart=restarts.append)
+        self.assertEqual(reader.getBody(), body[:256])
+        self.assertEqual(restarts, [])
+        self.assertEqual(self.adapter.stats['replayed'], 1)
+
+    def testPartIsReadAgainForReaderThatWantsMore(self):
+        self.storePart()
+        first = Reader()
+        second = Reader()
+
+        def restart():
+            return second.feed
+
+        # Revalidated with a 304, the part is fed and then the page is
+        # downloaded again, from its start, for a new reader.
+        self.transport().stream(url, first.feed, chunkSize=256, restart=restart)
+        self.assertEqual(first.getBody(), body[:256])
+        self.assertEqual(second.getBody(), body)
+        self.assertTrue(self.cache.get(url)['complete'])
+
+    def testPartIsAMissOffline(self):
+        self.storePart()
+        with self.assertRaises(CacheMiss):
+            self.transport(cacheOnly=True).stream(url, Reader().feed, chunkSize=256)
+
+
+class AdaptiveLimitTest(unittest.TestCase):
+    def reply(self, limit, latency, status=200):
+        limit.observe(time.monotonic(), latency=latency, status=status)
+
+    def cuts(self, limit):
+        return [entry['reason'] for entry in limit.getStats()['history']
+                if entry['reason'] not in ('start', 'increase')]
+
+    def testGrowsWhileRepliesAreFine(self):
+        limit = AdaptiveLimit(16, initial=4)
+        for i in range(300):
+            self.reply(limit, 0.1)
+        self.assertEqual(limit.getStats()['limit'], 16)
+
+    def testJitterDoesNotCut(self):
+        limit = AdaptiveLimit(16)
+        jitter = random.Random(0)
+        for i in range(2000):
+            self.reply(limit, jitter.uniform(0.05, 0.3))
+        self.assertEqual(self.cuts(limit), [])
+
+    def testSmallRiseDoesNotCut(self):
+        limit = AdaptiveLimit(16)
+        for latency in [0.002] * 20 + [0.03] * 100:
+            self.reply(limit, latency)
+        self.assertEqual(self.cuts(limit), [])
+
+    def testSustainedRiseCuts(self):
+        limit = AdaptiveLimit(16)
+        for i in range(20):
+            self.reply(limit, 0.1)
+        before = limit.getStats()['limit']
+        for i in range(20):
+            self.reply(limit, 0.5)
+        self.assertEqual(self.cuts(limit)[:1], ['slow'])
+        self.assertLess(limit.getStats()['limit'], before)
+
+    def testThrottlingAndErrorsCut(self):
+        for status, reason in ((429, 'throttled'), (503, 'error')):
+            limit = AdaptiveLimit(16)
+            self.reply(limit, 0.1, status)
+            self.assertEqual(limit.getStats()['limit'], 4)
+            self.assertEqual(self.cuts(limit), [reason])
+
+    def testOneOverloadCutsOnce(self):
+        limit = AdaptiveLimit(16)
+        started = time.monotonic()
+        for i in range(8):
+            limit.observe(started, timeout=True)
+        self.assertEqual(limit.getStats()['limit'], 4)
+        limit.observe(time.monotonic(), timeout=True)
+        self.assertEqual(limit.getStats()['limit'], 2)
+
+    def testStaysWithinBounds(self):
+        limit = AdaptiveLimit(4, minLimit=2)
+        for i in range(10):
+            self.reply(limit, 0.1, 503)
+        self.assertEqual(limit.getStats()['limit'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
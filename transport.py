@@ -0,0 +1,416 @@
+import threading
+import time
+import requests
+from contextlib import contextmanager, nullcontext
+from functools import partial
+from cache import CacheMiss
+from control import ScrapeControl
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class TokenBucket():
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        waited = 0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens +
+                                  (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class AdaptiveLimit():
+    # Additive increase, multiplicative decrease of the number of requests
+    # in flight. Every answer that comes back without trouble raises the
+    # limit by about one per limit's worth of answers; a timeout, a 429, a
+    # 5xx or a failed connection cuts it by decrease. So does latency that
+    # has risen and stayed up: the average of the last ten or so replies
+    # going above latencyFactor times the lowest such average seen, which
+    # one slow reply in the normal spread cannot do. Rises of less than
+    # latencySlack seconds are ignored, as they are more likely this
+    # process being busy than the server. Requests sent before the last
+    # cut cannot cut it again, so one overloaded moment counts only once.
+    def __init__(self, maxLimit, minLimit=1, initial=None, decrease=0.5, latencyFactor=2.0,
+                 latencySlack=0.05, historySize=1000):
+        self.maxLimit = max(maxLimit, minLimit)
+        self.minLimit = minLimit
+        if initial is None:
+            initial = max(minLimit, maxLimit // 2)
+        self.limit = float(min(max(initial, minLimit), self.maxLimit))
+        self.decrease = decrease
+        self.latencyFactor = latencyFactor
+        self.latencySlack = latencySlack
+        self.historySize = historySize
+        self.inFlight = 0
+        self.replies = 0
+        self.recentLatency = None
+        self.baseline = None
+        self.lastDecrease = None
+        self.started = time.monotonic()
+        self.history = [(0.0, int(self.limit), 'start')]
+        self.outcomes = {'ok': 0, 'slow': 0, 'timeout': 0, 'throttled': 0, 'error': 0}
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def slot(self, control=None):
+        with self.condition:
+            while self.inFlight >= int(self.limit):
+                self.condition.wait(0.1)
+                if control is not None:
+                    control.check()
+            self.inFlight += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.inFlight -= 1
+                self.condition.notify()
+
+    def observe(self, started, latency=None, status=None, timeout=False):
+        with self.condition:
+            if timeout:
+                outcome = 'timeout'
+            elif status == 429:
+                outcome = 'throttled'
+            elif status is None or status >= 500:
+                outcome = 'error'
+            else:
+                # The recent latency is a plain mean until there are ten
+                # replies, then moves by a tenth of each new one. The usual
+                # latency is the lowest recent latency seen, drifting
+                # slowly up towards it so it follows the server's load
+                # through the day.
+                self.replies += 1
+                if self.recentLatency is None:
+                    self.recentLatency = latency
+                self.recentLatency += (latency - self.recentLatency) * max(1 / self.replies, 0.1)
+                if self.replies <= 10 or self.recentLatency < self.baseline:
+                    self.baseline = self.recentLatency
+                else:
+                    self.baseline += (self.recentLatency - self.baseline) * 0.001
+                outcome = 'ok'
+                if self.recentLatency > max(self.baseline * self.latencyFactor,
+                                            self.baseline + self.latencySlack):
+                    outcome = 'slow'
+            self.outcomes[outcome] += 1
+            if outcome == 'ok':
+                self.setLimit(self.limit + 1 / self.limit, 'increase')
+            else:
+                if self.lastDecrease is None or started >= self.lastDecrease:
+                    self.lastDecrease = time.monotonic()
+                    self.setLimit(self.limit * self.decrease, outcome)
+                    if outcome == 'slow':
+                        # Replies to requests sent after the cut decide
+                        # whether it was enough.
+                        self.recentLatency = self.baseline
+            self.condition.notify_all()
+
+    def setLimit(self, limit, reason):
+        limit = min(max(limit, self.minLimit), self.maxLimit)
+        if int(limit) != int(self.limit):
+            self.history.append((round(time.monotonic() - self.started, 3), int(limit), reason))
+            del self.history[:-self.historySize]
+        self.limit = limit
+
+    def getStats(self):
+        with self.condition:
+            return {'limit': int(self.limit), 'minLimit': self.minLimit, 'maxLimit': self.maxLimit,
+                    'baselineLatency': self.baseline, 'recentLatency': self.recentLatency,
+                    'outcomes': dict(self.outcomes),
+                    'history': [{'time': at, 'limit': limit, 'reason': reason}
+                                for at, limit, reason in self.history]}
+
+
+class ControlledConnection():
+    control = None
+
+    def connect(self):
+        super().connect()
+        if self.control is not None:
+            self.control.hold(self)
+
+
+class ControlledHTTPConnection(ControlledConnection, HTTPConnection):
+    pass
+
+
+class ControlledHTTPSConnection(ControlledConnection, HTTPSConnection):
+    pass
+
+
+class ControlledPool():
+    # Hands each connection it lends out to control, so that cancelling a
+    # scrape also cuts off requests still waiting for their headers.
+    def __init__(self, *args, control=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.control = control
+
+    def _new_conn(self):
+        connection = super()._new_conn()
+        connection.control = self.control
+        return connection
+
+    def _get_conn(self, timeout=None):
+        connection = super()._get_conn(timeout)
+        self.control.hold(connection)
+        return connection
+
+
+class ControlledHTTPConnectionPool(ControlledPool, HTTPConnectionPool):
+    ConnectionCls = ControlledHTTPConnection
+
+
+class ControlledHTTPSConnectionPool(ControlledPool, HTTPSConnectionPool):
+    ConnectionCls = ControlledHTTPSConnection
+
+
+class Transport():
+    def __init__(self, poolSize=10, timeout=(5, 30), retries=3, backoff=0.5, rate=10, burst=10,
+                 cache=None, cacheOnly=False, maxAge=None, adapter=None, control=None, limit=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.rate = rate
+        self.burst = burst
+        self.cache = cache
+        self.cacheOnly = cacheOnly
+        self.maxAge = maxAge
+        if control is None:
+            control = ScrapeControl()
+        self.control = control
+        # An AdaptiveLimit, if given, decides how many requests may be in
+        # flight at once.
+        self.limit = limit
+
+        # adapter replaces the pooled HTTP adapter, e.g. to record or replay
+        # a scrape.
+        if adapter is None:
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=poolSize)
+        if getattr(adapter, 'poolmanager', None) is not None:
+            adapter.poolmanager.pool_classes_by_scheme = {
+                'http': partial(ControlledHTTPConnectionPool, control=control),
+                'https': partial(ControlledHTTPSConnectionPool, control=control)}
+        self.adapter = adapter
+        self.session = requests.Session()
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0,
+                      'throttleWaits': 0, 'throttleSeconds': 0.0,
+                      'cacheHits': 0, 'cacheRevalidated': 0, 'cacheMisses': 0}
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def throttle(self, host):
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst)
+            bucket = self.buckets[host]
+        waited = bucket.take()
+        if waited > 0:
+            self.count('throttleWaits')
+            self.count('throttleSeconds', waited)
+
+    def lookup(self, url):
+        # Returns the cache entry for url, if any, and whether it may be
+        # used without asking the server.
+        if self.cache is None:
+            return None, False
+        cached = self.cache.get(url)
+        if cached is not None and (self.cacheOnly or (self.maxAge is not None and
+                                                      time.time() - cached['stored'] < self.maxAge)):
+            self.count('cacheHits')
+            return cached, True
+        if self.cacheOnly:
+            self.count('cacheMisses')
+            raise CacheMiss('Not in the response cache: ' + url)
+        return cached, False
+
+    def conditionalHeaders(self, cached):
+        headers = {}
+        if cached is not None:
+            if cached['etag'] is not None:
+                headers['If-None-Match'] = cached['etag']
+            if cached['modified'] is not None:
+                headers['If-Modified-Since'] = cached['modified']
+        return headers
+
+    def get(self, url):
+        cached, fresh = self.lookup(url)
+        if cached is not None and not cached['complete']:
+            cached, fresh = None, False
+        if fresh:
+            return self.cachedResponse(url, cached)
+
+        with self.slot():
+            response = self.send(url, headers=self.conditionalHeaders(cached))
+
+        if response.status_code == 304 and cached is not None:
+            self.count('cacheRevalidated')
+            self.cache.touch(url)
+            return self.cachedResponse(url, cached)
+        if self.cache is not None:
+            self.count('cacheMisses')
+            if response.status_code == 200:
+                self.cache.put(url, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                               response.encoding, response.content)
+        return response
+
+    def stream(self, url, consume, chunkSize=16384, restart=None):
+        # Feeds the body of url to consume(chunk, encoding) until it returns
+        # True or the body ends, so readers that can decide early need not
+        # download the whole page. A cached body that was cut short is only
+        # replayed when restart is given: should consume want more than was
+        # cached, the page is downloaded again for the new consumer restart()
+        # returns, since the first one has already seen its start.
+        cached, fresh = self.lookup(url)
+        if cached is not None and not cached['complete'] and restart is None:
+            if self.cacheOnly:
+                raise CacheMiss('Only part of this page is cached: ' + url)
+            cached, fresh = None, False
+        if fresh:
+            if self.feedCached(cached, consume, chunkSize) or cached['complete']:
+                return
+            if self.cacheOnly:
+                raise CacheMiss('Only part of this page is cached: ' + url)
+            consume = restart()
+            cached = None
+
+        with self.slot():
+            response = self.send(url, headers=self.conditionalHeaders(cached), stream=True)
+            self.control.track(response)
+            try:
+                if response.status_code == 304 and cached is not None:
+                    self.count('cacheRevalidated')
+                    self.cache.touch(url)
+                    if self.feedCached(cached, consume, chunkSize) or cached['complete']:
+                        return
+                    consume = restart()
+                    self.control.untrack(response)
+                    response.close()
+                    response = self.send(url, stream=True)
+                    self.control.track(response)
+
+                chunks = []
+                stopped = False
+                try:
+                    for chunk in response.iter_content(chunkSize):
+                        self.control.check()
+                        chunks.append(chunk)
+                        if consume(chunk, response.encoding):
+                            stopped = True
+                            break
+                except requests.RequestException:
+                    self.control.check()
+                    raise
+                # An aborted read can look like the end of the body.
+                self.control.check()
+                if self.cache is not None:
+                    self.count('cacheMisses')
+                    if response.status_code == 200:
+                        self.cache.put(url, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                                       response.encoding, b"".join(chunks), not stopped)
+            finally:
+                self.control.untrack(response)
+                response.close()
+
+    def feedCached(self, cached, consume, chunkSize):
+        body = cached['body']
+        for start in range(0, len(body), chunkSize):
+            if consume(body[start:start + chunkSize], cached['encoding']):
+                return True
+        return False
+
+    def cachedResponse(self, url, cached):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.encoding = cached['encoding']
+        response._content = cached['body']
+        return response
+
+    def slot(self):
+        if self.limit is None:
+            return nullcontext()
+        return self.limit.slot(self.control)
+
+    def observe(self, started, **kwargs):
+        if self.limit is not None:
+            self.limit.observe(started, **kwargs)
+
+    def send(self, url, **kwargs):
+        # Retries failed connections, timeouts, 429 and 5xx replies with
+        # exponential backoff, and raises once the retries are used up.
+        # Latency is measured up to the headers.
+        host = urlsplit(url).netloc
+        attempt = 0
+        while True:
+            self.control.waitIfPaused()
+            self.throttle(host)
+            self.count('requests')
+            start = time.monotonic()
+            try:
+                response = self.session.get(url, timeout=self.timeout, **kwargs)
+            except requests.Timeout:
+                self.control.check()
+                self.observe(start, timeout=True)
+                if attempt >= self.retries:
+                    raise
+            except requests.ConnectionError:
+                self.control.check()
+                self.observe(start)
+                if attempt >= self.retries:
+                    raise
+            else:
+                self.observe(start, latency=time.monotonic() - start, status=response.status_code)
+                if response.status_code < 500 and response.status_code != 429:
+                    return response
+                response.close()
+                if attempt >= self.retries:
+                    # Other client errors, such as a missing page, are
+                    # left for the reader to judge.
+                    response.raise_for_status()
+            finally:
+                self.control.release()
+            attempt += 1
+            self.count('retries')
+            self.control.sleep(self.backoff * 2 ** (attempt - 1))
+
+    def getStats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        opened = 0
+        sent = 0
+        poolManager = getattr(self.adapter, 'poolmanager', None)
+        pools = poolManager.pools if poolManager is not None else {}
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                sent += pool.num_requests
+        stats['connectionsOpened'] = opened
+        stats['connectionsReused'] = max(sent - opened, 0)
+        return stats
+
+    def close(self):
+        self.session.close()
@@ -1,4 +1,7 @@
+import difflib
+import html
 import sys
+from highlight import HIGHLIGHT_START, HIGHLIGHT_END
 from software import Software
 from PyQt5 import QtCore, QtGui, QtWidgets
 
@@ -44,47 +47,183 @@ class CustomLineEdit(QtWidgets.QLineEdit):
         self.setText(self.suggestion)
 
 
-class SoftwareWidget(QtWidgets.QWidget):
-    def __init__(self, font, parent=None):
-        super(SoftwareWidget, self).__init__(parent)
-        self.setStyleSheet("""
-            QLabel {
-                background = transparent;
-            }
-        """)
-        self.vBoxLayout = QtWidgets.QVBoxLayout()
-        self.font = font
-
-        self.font.setBold(True)
-
-        self.team = QtWidgets.QLabel()
-        self.team.setFont(self.font)
-        self.team.setWordWrap(True)
-
-        self.font.setBold(False)
+class SoftwareListModel(QtCore.QAbstractListModel):
+    SoftwareRole = QtCore.Qt.UserRole
+    SnippetRole = QtCore.Qt.UserRole + 1
 
-        self.description = QtWidgets.QLabel()
-        self.description.setFont(self.font)
-        self.description.setWordWrap(True)
-        self.description.setAlignment(QtCore.Qt.AlignJustify)
-
-        self.year = QtWidgets.QLabel()
-        self.year.setFont(self.font)
-        self.year.setWordWrap(True)
-
-        self.vBoxLayout.addWidget(self.team)
-        self.vBoxLayout.addWidget(self.description)
-        self.vBoxLayout.addWidget(self.year)
-        self.setLayout(self.vBoxLayout)
-
-    def setTeam(self, text):
-        self.team.setText(text)
-
-    def setDescription(self, text):
-        self.description.setText(text)
+    def __init__(self, parent=None):
+        super(SoftwareListModel, self).__init__(parent)
+        self.rows = []
+        self.source = None
+        self.pageSize = 0
+        self.exhausted = True
+        self.loading = False
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.rows)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        software, snippet = self.rows[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return software.team
+        if role == self.SoftwareRole:
+            return software
+        if role == self.SnippetRole:
+            return snippet
+        return None
+
+    def setSoftware(self, rows):
+        self.beginResetModel()
+        self.rows = list(rows)
+        self.source = None
+        self.exhausted = True
+        self.loading = False
+        self.endResetModel()
+
+    def updateSoftware(self, rows):
+        # Moves the list to rows with the smallest set of row removals and
+        # insertions, so unchanged results keep their place and selection.
+        self.source = None
+        self.exhausted = True
+        self.loading = False
+        oldKeys = [(software.team, software.year) for software, snippet in self.rows]
+        newKeys = [(software.team, software.year) for software, snippet in rows]
+        matcher = difflib.SequenceMatcher(None, oldKeys, newKeys, autojunk=False)
+        for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+            if tag == 'equal':
+                self.rows[i1:i2] = rows[j1:j2]
+                self.dataChanged.emit(self.index(i1), self.index(i2 - 1))
+                continue
+            if i2 > i1:
+                self.beginRemoveRows(QtCore.QModelIndex(), i1, i2 - 1)
+                del self.rows[i1:i2]
+                self.endRemoveRows()
+            if j2 > j1:
+                self.beginInsertRows(QtCore.QModelIndex(), i1, i1 + j2 - j1 - 1)
+                self.rows[i1:i1] = rows[j1:j2]
+                self.endInsertRows()
+
+    def setSource(self, source, pageSize=100):
+        # source(last) requests the page of rows following the Software
+        # last, or the first page when last is None, and hands it back
+        # through addPage.
+        self.beginResetModel()
+        self.rows = []
+        self.source = source
+        self.pageSize = pageSize
+        self.exhausted = False
+        self.loading = False
+        self.endResetModel()
+        self.fetchMore(QtCore.QModelIndex())
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and not self.exhausted and not self.loading
+
+    def fetchMore(self, parent):
+        if not self.canFetchMore(parent):
+            return
+        self.loading = True
+        last = self.rows[-1][0] if len(self.rows) > 0 else None
+        self.source(last)
+
+    def addPage(self, rows):
+        self.loading = False
+        if len(rows) < self.pageSize:
+            self.exhausted = True
+        self.addSoftware(rows)
+
+    def addSoftware(self, rows):
+        if len(rows) == 0:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), len(
+            self.rows), len(self.rows) + len(rows) - 1)
+        self.rows.extend(rows)
+        self.endInsertRows()
+
+    def clear(self):
+        self.setSoftware([])
+
+
+class SoftwareDelegate(QtWidgets.QStyledItemDelegate):
+    margin = 11
+    spacing = 6
 
-    def setYear(self, text):
-        self.year.setText(text)
+    def __init__(self, font, parent=None):
+        super(SoftwareDelegate, self).__init__(parent)
+        self.font = QtGui.QFont(font)
+        self.boldFont = QtGui.QFont(font)
+        self.boldFont.setBold(True)
+        self.document = QtGui.QTextDocument()
+        self.document.setDefaultFont(self.font)
+        self.document.setDocumentMargin(0)
+
+    def textWidth(self, option):
+        width = option.rect.width()
+        if width <= 0 and self.parent() is not None:
+            width = self.parent().viewport().width()
+        return max(width - 2 * self.margin, 1)
+
+    def blockHeight(self, font, text, width):
+        metrics = QtGui.QFontMetrics(font)
+        return metrics.boundingRect(QtCore.QRect(0, 0, width, 0), QtCore.Qt.TextWordWrap, text).height()
+
+    def descriptionText(self, index):
+        snippet = index.data(SoftwareListModel.SnippetRole)
+        if snippet is None:
+            return index.data(SoftwareListModel.SoftwareRole).description
+        return snippet.replace(HIGHLIGHT_START, "").replace(HIGHLIGHT_END, "")
+
+    def sizeHint(self, option, index):
+        software = index.data(SoftwareListModel.SoftwareRole)
+        width = self.textWidth(option)
+        height = self.blockHeight(self.boldFont, software.team, width) + \
+            self.blockHeight(self.font, self.descriptionText(index), width) + \
+            self.blockHeight(self.font, str(software.year), width)
+        return QtCore.QSize(width + 2 * self.margin, height + 2 * self.margin + 2 * self.spacing)
+
+    def paint(self, painter, option, index):
+        self.initStyleOption(option, index)
+        style = option.widget.style() if option.widget is not None else QtWidgets.QApplication.style()
+        style.drawPrimitive(QtWidgets.QStyle.PE_PanelItemViewItem, option, painter, option.widget)
+
+        software = index.data(SoftwareListModel.SoftwareRole)
+        snippet = index.data(SoftwareListModel.SnippetRole)
+        width = self.textWidth(option)
+        x = option.rect.x() + self.margin
+        y = option.rect.y() + self.margin
+
+        painter.save()
+        painter.setPen(option.palette.color(QtGui.QPalette.Text))
+
+        painter.setFont(self.boldFont)
+        height = self.blockHeight(self.boldFont, software.team, width)
+        painter.drawText(QtCore.QRect(x, y, width, height),
+                         QtCore.Qt.TextWordWrap, software.team)
+        y += height + self.spacing
+
+        painter.setFont(self.font)
+        height = self.blockHeight(self.font, self.descriptionText(index), width)
+        if snippet is None:
+            painter.drawText(QtCore.QRect(x, y, width, height),
+                             QtCore.Qt.TextWordWrap | QtCore.Qt.AlignJustify, software.description)
+        else:
+            self.document.setHtml(html.escape(snippet).replace(
+                HIGHLIGHT_START, "<b>").replace(HIGHLIGHT_END, "</b>"))
+            self.document.setTextWidth(width)
+            painter.translate(x, y)
+            self.document.drawContents(
+                painter, QtCore.QRectF(0, 0, width, height))
+            painter.translate(-x, -y)
+        y += height + self.spacing
+
+        height = self.blockHeight(self.font, str(software.year), width)
+        painter.drawText(QtCore.QRect(x, y, width, height),
+                         QtCore.Qt.TextWordWrap, str(software.year))
+        painter.restore()
 
 
 class View:
@@ -101,7 +240,7 @@ class View:
                 border: 1px solid rgb(209, 209, 209);
                 color: rgb(70, 70, 70);
             }
-            QListWidget {
+            QListView {
                 border: none;
                 color: rgb(70, 70, 70);
                 outline: 0;
@@ -121,7 +260,7 @@ class View:
             }
         """)
 
-        self.font = self.loadFont()
+        self.font = None
 
         self.mainLayout = QtWidgets.QGridLayout(self.window)
         self.mainLayout.setSpacing(0)
@@ -141,13 +280,16 @@ class View:
         self.stackedWidget.addWidget(self.info)
         self.stackedWidget.addWidget(self.addEdit)
 
-        self.menuButtons = []
+        # Only the home page is built up front; the others are built the
+        # first time they are shown. pageListeners are called with the index
+        # of each page once it has been built.
+        self.menuButtons = {}
+        self.builders = [self.setupHome, self.setupLibrary,
+                         self.setupScrape, self.setupInfo, self.setupAddEdit]
+        self.built = set()
+        self.pageListeners = []
 
-        self.setupHome()
-        self.setupLibrary()
-        self.setupScrape()
-        self.setupInfo()
-        self.setupAddEdit()
+        self.buildPage(0)
 
         self.mainLayout.addWidget(self.stackedWidget)
 
@@ -158,6 +300,16 @@ class View:
 
         # self.window.show()
 
+    def buildPage(self, index):
+        if index in self.built:
+            return
+        if self.font is None and index != 0:
+            self.font = self.loadFont()
+        self.builders[index]()
+        self.built.add(index)
+        for listener in self.pageListeners:
+            listener(index)
+
     def loadFont(self):
         fontDb = QtGui.QFontDatabase()
         fontId = fontDb.addApplicationFont(
@@ -195,7 +347,7 @@ class View:
 
         buttons = [backButton, homeButton,
                    libraryButton, scrapeButton, infoButton]
-        self.menuButtons.append(buttons)
+        self.menuButtons[self.stackedWidget.indexOf(page)] = buttons
 
         menuBarLayout.addWidget(logo)
         menuBarLayout.addWidget(backButton)
@@ -297,17 +449,23 @@ class View:
 
         self.librarySearchLine = CustomLineEdit()
         self.librarySearchLine.setFont(font)
-        self.librarySearchLine.setSuggestion("Enter a year")
+        self.librarySearchLine.setSuggestion("Enter a team, description or year")
 
         self.librarySearchLayout.addWidget(self.librarySearchInstr)
         self.librarySearchLayout.addWidget(self.librarySearchLine)
 
         self.librarySearchWidget.setLayout(self.librarySearchLayout)
 
-        self.libraryResultsList = QtWidgets.QListWidget()
+        self.libraryResults = SoftwareListModel()
+        self.libraryResultsList = QtWidgets.QListView()
         self.libraryResultsList.setFont(font)
         self.libraryResultsList.setVerticalScrollMode(
             QtWidgets.QAbstractItemView.ScrollPerPixel)
+        self.libraryResultsList.setResizeMode(QtWidgets.QListView.Adjust)
+        self.libraryResultsList.setLayoutMode(QtWidgets.QListView.Batched)
+        self.libraryResultsList.setModel(self.libraryResults)
+        self.libraryResultsList.setItemDelegate(
+            SoftwareDelegate(font, self.libraryResultsList))
 
         self.libraryInfoLayout.addWidget(self.librarySearchWidget)
         self.libraryInfoLayout.addWidget(self.libraryResultsList)
@@ -357,17 +515,43 @@ class View:
 
         self.scrapeSearchWidget.setLayout(self.scrapeSearchLayout)
 
-        self.scrapeResultsList = QtWidgets.QListWidget()
+        self.scrapeResults = SoftwareListModel()
+        self.scrapeResultsList = QtWidgets.QListView()
         self.scrapeResultsList.setFont(font)
         self.scrapeResultsList.setVerticalScrollMode(
             QtWidgets.QAbstractItemView.ScrollPerPixel)
+        self.scrapeResultsList.setResizeMode(QtWidgets.QListView.Adjust)
+        self.scrapeResultsList.setLayoutMode(QtWidgets.QListView.Batched)
+        self.scrapeResultsList.setModel(self.scrapeResults)
+        self.scrapeResultsList.setItemDelegate(
+            SoftwareDelegate(font, self.scrapeResultsList))
 
         self.progressBar = QtWidgets.QProgressBar()
         self.progressBar.setTextVisible(False)
 
+        self.scrapeMetrics = QtWidgets.QLabel()
+        self.scrapeMetrics.setFont(font)
+
+        self.scrapeButtonsLayout = QtWidgets.QHBoxLayout()
+        self.scrapeButtonsLayout.setAlignment(QtCore.Qt.AlignHCenter)
+
+        self.pauseButton = ClickableLabel()
+        self.pauseButton.setFont(font)
+        self.stopButton = ClickableLabel()
+        self.stopButton.setImages("<html><body><p><img src=\"icons/cancel-default.png\"></p></body></html>",
+                                  "<html><body><p><img src=\"icons/cancel-hover.png\"></p></body></html>")
+
+        self.scrapeButtonsLayout.addWidget(self.pauseButton)
+        self.scrapeButtonsLayout.addWidget(self.stopButton)
+
+        self.setPaused(False)
+        self.setScraping(False)
+
         self.scrapeInfoLayout.addWidget(self.scrapeSearchWidget)
         self.scrapeInfoLayout.addWidget(self.scrapeResultsList)
         self.scrapeInfoLayout.addWidget(self.progressBar)
+        self.scrapeInfoLayout.addWidget(self.scrapeMetrics)
+        self.scrapeInfoLayout.addLayout(self.scrapeButtonsLayout)
 
         self.scrapeInfoLayout.addItem(QtWidgets.QSpacerItem(
             20, 0, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum))
@@ -528,6 +712,16 @@ class View:
 
         self.addEditLayout.addLayout(self.addEditContentLayout)
 
+    def setScraping(self, scraping):
+        self.pauseButton.setVisible(scraping)
+        self.stopButton.setVisible(scraping)
+        self.scrapeSearchLine.setEnabled(not scraping)
+
+    def setPaused(self, paused):
+        text = "Resume" if paused else "Pause"
+        self.pauseButton.setImages("<html><body><p>{}</p></body></html>".format(text),
+                                   "<html><body><p><u>{}</u></p></body></html>".format(text))
+
     def enableAddEdit(self):
         self.addEditDescription.setEnabled(True)
 
@@ -551,6 +745,7 @@ class View:
         self.cancelButton.setVisible(False)
 
     def switchTo(self, index):
+        self.buildPage(index)
         self.window.setFocus()
         if index == 1:
             self.librarySearchLine.showSuggestion()
@@ -569,19 +764,6 @@ class View:
             self.currentPage = self.pageHistory[-2]
             del self.pageHistory[-1]
 
-    def addToList(self, softwareList, software):
-        softwareWidget = SoftwareWidget(self.font)
-
-        softwareWidget.setTeam(software.team)
-        softwareWidget.setDescription(software.description)
-        softwareWidget.setYear(software.year)
-
-        softwareItem = QtWidgets.QListWidgetItem(softwareList)
-        softwareItem.setSizeHint(softwareWidget.sizeHint())
-
-        softwareList.addItem(softwareItem)
-        softwareList.setItemWidget(softwareItem, softwareWidget)
-
 
 if __name__ == '__main__':
     view = View()